@@ -0,0 +1,46 @@
+"""Add composite indexes for agent queries
+
+Revision ID: 9e4b1d7c3a60
+Revises: 5c2e8f1a9d47
+Create Date: 2026-10-18 11:03:27.518904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4b1d7c3a60'
+down_revision: Union[str, None] = '5c2e8f1a9d47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, columns). Built CONCURRENTLY so the tables stay writable while a large
+# thread_messages table is indexed, which can't happen inside a transaction.
+INDEXES = [
+    ('ix_threads_user_id_status', 'threads', ['user_id', 'status']),
+    ('ix_threads_user_id_created_at', 'threads', ['user_id', 'created_at']),
+    ('ix_thread_tasks_thread_id_status', 'thread_tasks', ['thread_id', 'status']),
+    ('ix_thread_task_plans_thread_task_id_status', 'thread_task_plans', ['thread_task_id', 'status']),
+    ('ix_plan_subtasks_thread_task_plan_id_ordering', 'plan_subtasks', ['thread_task_plan_id', 'ordering']),
+    ('ix_thread_task_memory_entries_thread_task_id', 'thread_task_memory_entries', ['thread_task_id']),
+    ('ix_thread_messages_thread_id_created_at_id', 'thread_messages', ['thread_id', 'created_at', 'id']),
+    ('ix_thread_messages_thread_task_id_chat_type_created_at', 'thread_messages',
+     ['thread_task_id', 'thread_chat_type', 'created_at']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,73 @@
+"""
+Measures how long `import main` takes in a fresh interpreter, i.e. the worker boot cost before uvicorn can
+serve a request, and fails when the median goes over the budget.
+
+Run from the backend directory with the deployment's .env in place:
+
+    python benchmarks/startup_import_time.py --runs 5 --budget 2.5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE_SNIPPET = (
+    'import time; started = time.perf_counter(); import main; '
+    'print(time.perf_counter() - started)'
+)
+
+
+def measure_once() -> float:
+    result = subprocess.run(
+        [sys.executable, '-c', MEASURE_SNIPPET],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(limit: int) -> list:
+    """Modules imported directly by main, sorted by cumulative import time, from python -X importtime."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented two spaces per level under their parent, keep main's direct imports
+        if name.startswith('   ') and not name.startswith('     '):
+            modules.append((int(cumulative) / 1_000_000, name.strip()))
+    return sorted(modules, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=float(os.getenv('STARTUP_IMPORT_BUDGET_SECONDS', '2.5')),
+                        help='maximum median import time in seconds')
+    parser.add_argument('--top', type=int, default=15, help='number of slowest imports of main to list')
+    args = parser.parse_args()
+
+    timings = [measure_once() for _ in range(args.runs)]
+    median = statistics.median(timings)
+
+    print(f"import main: median {median:.3f}s, min {min(timings):.3f}s, max {max(timings):.3f}s "
+          f"over {args.runs} runs (budget {args.budget:.3f}s)")
+    print('\nSlowest imports of main:')
+    for seconds, name in slowest_imports(args.top):
+        print(f"  {seconds:8.3f}s  {name}")
+
+    if median > args.budget:
+        print(f"\n❌ Startup import time is over budget by {median - args.budget:.3f}s")
+        sys.exit(1)
+    print('\n✅ Startup import time is within budget')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Compares the prompt token count of interactive UI elements in the json and table encodings
+(see utils/ui_encoding.py).
+
+Run from the backend directory, either on synthetic windows of increasing size or on a captured element list
+(the `current_interactive_elements` of a next_step request saved as JSON):
+
+    python benchmarks/ui_encoding_tokens.py
+    python benchmarks/ui_encoding_tokens.py --input elements.json
+
+Counting tokens needs tiktoken, which the backend itself doesn't: pip install -r benchmarks/requirements.txt
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+import tiktoken
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ui_encoding import encode_elements_table  # noqa: E402
+
+
+ELEMENT_TYPES = ['Button', 'Edit', 'MenuItem', 'ListItem', 'TabItem', 'Hyperlink', 'CheckBox', 'Text', 'TreeItem']
+LABEL_WORDS = ['File', 'Edit', 'View', 'Save', 'Open', 'Search', 'Inbox', 'Settings', 'Send', 'Reply', 'New',
+               'Message', 'Downloads', 'Documents', 'Close', 'Minimize', 'Back', 'Forward', 'Refresh', 'Share']
+
+
+def synthetic_elements(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    elements = []
+    for idx in range(count):
+        # Roughly a third of native elements come without a label
+        label = '' if rng.random() < 0.3 else ' '.join(rng.choices(LABEL_WORDS, k=rng.randint(1, 3)))
+        elements.append({
+            'id': idx,
+            'type': rng.choice(ELEMENT_TYPES),
+            'label': label,
+            'bounding_box': {
+                'x': rng.randint(0, 1200),
+                'y': rng.randint(0, 700),
+                'width': rng.randint(10, 300),
+                'height': rng.randint(10, 60),
+            },
+        })
+    return elements
+
+
+def compare(name: str, elements: list, encoder) -> tuple:
+    json_tokens = len(encoder.encode(json.dumps(elements)))
+    table_tokens = len(encoder.encode(encode_elements_table(elements)))
+    saved = 1 - table_tokens / json_tokens if json_tokens else 0.0
+    print(f"{name:>22} {len(elements):>9} {json_tokens:>12} {table_tokens:>12} {saved:>9.1%}")
+    return json_tokens, table_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', help='JSON file with a list of interactive elements')
+    parser.add_argument('--sizes', default='25,100,400,1000', help='synthetic element counts, comma separated')
+    parser.add_argument('--encoding', default='o200k_base', help='tiktoken encoding used to count tokens')
+    args = parser.parse_args()
+
+    encoder = tiktoken.get_encoding(args.encoding)
+
+    print(f"{'sample':>22} {'elements':>9} {'json tokens':>12} {'table tokens':>12} {'saved':>9}")
+    if args.input:
+        with open(args.input) as f:
+            compare(os.path.basename(args.input), json.load(f), encoder)
+    else:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            compare('synthetic', synthetic_elements(size), encoder)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from sqlmodel import create_engine, Session
 from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from dotenv import load_dotenv
@@ -16,17 +17,43 @@ if 'postgresql+psycopg2' in DATABASE_URL:
 else:
     ASYNC_DATABASE_URL = DATABASE_URL.replace('postgresql://', 'postgresql+asyncpg://')
 
+DB_POOL_SIZE = 12
+DB_MAX_OVERFLOW = 18
+
 engine = create_engine(DATABASE_URL, echo=True)
 
 async_engine = create_async_engine(
     ASYNC_DATABASE_URL,
     echo=True,
     future=True,
-    pool_size=12,
-    max_overflow=18,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
     pool_pre_ping=True,
 )
 
+_pool_usage = {'peak_checked_out': 0}
+
+
+@event.listens_for(async_engine.sync_engine, 'checkout')
+def _track_pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    _pool_usage['peak_checked_out'] = max(_pool_usage['peak_checked_out'], async_engine.pool.checkedout())
+
+
+def get_pool_stats() -> dict:
+    """
+    Occupancy of the async engine's connection pool.
+    peak_checked_out is the highest number of connections held at once since the process started.
+    """
+    pool = async_engine.pool
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': pool.overflow(),
+        'peak_checked_out': _pool_usage['peak_checked_out'],
+    }
+
 SessionLocal = sessionmaker(class_=Session, bind=engine, autocommit=False, autoflush=False)
 
 AsyncSessionLocal = async_sessionmaker(
@@ -53,4 +80,14 @@ async def get_async_session() -> AsyncSession:
             await session.rollback()
             raise
         finally:
-            await session.close()
\ No newline at end of file
+            await session.close()
+
+
+async def release_connection(session: AsyncSession):
+    """
+    End the session's current transaction so its connection goes back to the pool before a slow await
+    (LLM calls, tool runs). Loaded objects stay usable since expire_on_commit is off, and the session
+    checks a connection out again on its next query.
+    """
+    if session.in_transaction():
+        await session.commit()
@@ -2,7 +2,7 @@ from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List
 import datetime
 from enum import Enum
-from sqlalchemy import Column, Text
+from sqlalchemy import Column, Text, Index
 from utils.procedures import generate_user_id, generate_ver_token, generate_random_number, generate_thread_id
 
 
@@ -81,6 +81,10 @@ class ThreadStatus(str, Enum):
 
 class Thread(SQLModel, table=True):
     __tablename__ = 'threads'
+    __table_args__ = (
+        Index('ix_threads_user_id_status', 'user_id', 'status'),
+        Index('ix_threads_user_id_created_at', 'user_id', 'created_at'),
+    )
 
     id: Optional[str] = Field(primary_key=True, index=True, nullable=False, default_factory=generate_thread_id)
     title: str = Field(nullable=False)
@@ -92,8 +96,9 @@ class Thread(SQLModel, table=True):
                                                     sa_column_kwargs={'onupdate': datetime.datetime.now})
 
     user: Optional['User'] = Relationship(back_populates='threads')
-    thread_tasks: List['ThreadTask'] = Relationship(back_populates='thread', sa_relationship_kwargs={'lazy': 'selectin'})
-    thread_messages: List['ThreadMessage'] = Relationship(back_populates='thread', sa_relationship_kwargs={'lazy': 'selectin'})
+    # Not loaded unless a query asks for them with selectinload(), every agent step selects its Thread
+    thread_tasks: List['ThreadTask'] = Relationship(back_populates='thread', sa_relationship_kwargs={'lazy': 'noload'})
+    thread_messages: List['ThreadMessage'] = Relationship(back_populates='thread', sa_relationship_kwargs={'lazy': 'noload'})
 
 
 class ThreadTaskStatus(str, Enum):
@@ -105,6 +110,9 @@ class ThreadTaskStatus(str, Enum):
 
 class ThreadTask(SQLModel, table=True):
     __tablename__ = 'thread_tasks'
+    __table_args__ = (
+        Index('ix_thread_tasks_thread_id_status', 'thread_id', 'status'),
+    )
 
     id: Optional[int] = Field(primary_key=True, index=True, nullable=False)
     thread_id: str = Field(nullable=False, foreign_key='threads.id')
@@ -134,6 +142,9 @@ class ThreadTaskPlanStatus(str, Enum):
 
 class ThreadTaskPlan(SQLModel, table=True):
     __tablename__ = 'thread_task_plans'
+    __table_args__ = (
+        Index('ix_thread_task_plans_thread_task_id_status', 'thread_task_id', 'status'),
+    )
 
     id: Optional[int] = Field(primary_key=True, index=True, nullable=False)
     thread_task_id: Optional[int] = Field(nullable=True, foreign_key='thread_tasks.id')
@@ -161,6 +172,9 @@ class SubtaskType(str, Enum):
 
 class PlanSubtask(SQLModel, table=True):
     __tablename__ = 'plan_subtasks'
+    __table_args__ = (
+        Index('ix_plan_subtasks_thread_task_plan_id_ordering', 'thread_task_plan_id', 'ordering'),
+    )
 
     id: Optional[int] = Field(primary_key=True, index=True, nullable=False)
     thread_task_plan_id: Optional[int] = Field(nullable=True, foreign_key='thread_task_plans.id')
@@ -181,7 +195,7 @@ class ThreadTaskMemoryEntry(SQLModel, table=True):
     __tablename__ = 'thread_task_memory_entries'
 
     id: Optional[int] = Field(primary_key=True, index=True, nullable=False)
-    thread_task_id: Optional[int] = Field(nullable=True, foreign_key='thread_tasks.id')
+    thread_task_id: Optional[int] = Field(nullable=True, foreign_key='thread_tasks.id', index=True)
     text: str = Field(sa_column=Column(Text, nullable=False))
 
     created_at: Optional[datetime.datetime] = Field(default_factory=datetime.datetime.now)
@@ -211,6 +225,11 @@ class ThreadChatFromChoices(str, Enum):
 
 class ThreadMessage(SQLModel, table=True):
     __tablename__ = 'thread_messages'
+    __table_args__ = (
+        Index('ix_thread_messages_thread_id_created_at_id', 'thread_id', 'created_at', 'id'),
+        Index('ix_thread_messages_thread_task_id_chat_type_created_at',
+              'thread_task_id', 'thread_chat_type', 'created_at'),
+    )
 
     id: Optional[int] = Field(primary_key=True, index=True, nullable=False)
     thread_id: str = Field(nullable=False, foreign_key='threads.id')
@@ -229,5 +248,29 @@ class ThreadMessage(SQLModel, table=True):
                                                     sa_column_kwargs={'onupdate': datetime.datetime.now})
 
     thread: Optional['Thread'] = Relationship(back_populates='thread_messages')
-    thread_task: Optional['ThreadTask'] = Relationship(back_populates='thread_task_messages', sa_relationship_kwargs={'lazy': 'selectin'})
+    thread_task: Optional['ThreadTask'] = Relationship(back_populates='thread_task_messages', sa_relationship_kwargs={'lazy': 'noload'})
     plan_subtask: Optional['PlanSubtask'] = Relationship(back_populates='plan_subtask_messages')
+
+
+class LLMUsageRecord(SQLModel, table=True):
+    __tablename__ = 'llm_usage_records'
+
+    id: Optional[int] = Field(primary_key=True, index=True, nullable=False)
+    # No foreign keys: records are written behind the request and can reach the database before the
+    # transaction that created their thread/task has committed
+    user_id: Optional[str] = Field(nullable=True, index=True)
+    thread_id: Optional[str] = Field(nullable=True)
+    thread_task_id: Optional[int] = Field(nullable=True)
+    plan_subtask_id: Optional[int] = Field(nullable=True)
+    agent: str = Field(nullable=False)
+    model_type: str = Field(nullable=False)
+    model_id: str = Field(nullable=False)
+    input_tokens: int = Field(default=0, nullable=False)
+    output_tokens: int = Field(default=0, nullable=False)
+    cache_read_tokens: int = Field(default=0, nullable=False)
+    cache_creation_tokens: int = Field(default=0, nullable=False)
+    latency_ms: int = Field(default=0, nullable=False)
+    has_screenshot: bool = Field(default=False)
+    failed: bool = Field(default=False)
+
+    created_at: Optional[datetime.datetime] = Field(default_factory=datetime.datetime.now, index=True)
@@ -0,0 +1,64 @@
+from typing import Callable, List, Tuple
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import SQLModel, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.write_behind import message_log_queue
+from db.models import ThreadMessage
+
+
+class StepUnitOfWork:
+    """
+    Collects the rows and status transitions produced by one agent step and writes them in a single commit.
+
+    New rows are inserted in one flush (the ORM batches them into multi-row INSERT ... RETURNING, so ids are
+    populated without refreshing). Status transitions become plain UPDATE statements by primary key, which
+    also works for detached instances such as the ones kept in the agent context cache.
+
+    With MESSAGE_LOG_DURABILITY=async, message and memory rows skip the transaction and are handed to the
+    write-behind queue instead.
+    """
+
+    def __init__(self):
+        self.rows: List[SQLModel] = []
+        self.transitions: List[Tuple[SQLModel, dict]] = []
+        self._on_commit: List[Callable[[], None]] = []
+
+    def add(self, row: SQLModel) -> SQLModel:
+        self.rows.append(row)
+        return row
+
+    def transition(self, instance: SQLModel, **values):
+        """Queue an UPDATE of instance's row, instance itself is updated once the commit went through."""
+        self.transitions.append((instance, values))
+
+    def on_commit(self, callback: Callable[[], None]):
+        """Run callback once the step has been committed, e.g. to keep in-memory caches in sync."""
+        self._on_commit.append(callback)
+
+    async def commit(self, db: AsyncSession):
+        # Queued rows are keyed by thread so the agent context can wait for just its thread's rows,
+        # memory entries only carry their task and take the thread of the step's messages
+        thread_id = next((row.thread_id for row in self.rows if isinstance(row, ThreadMessage)), None)
+        rows = []
+        for row in self.rows:
+            if message_log_queue.accepts(row):
+                await message_log_queue.put(row, key=getattr(row, 'thread_id', None) or thread_id)
+            else:
+                rows.append(row)
+
+        if rows or self.transitions:
+            for instance, values in self.transitions:
+                model = type(instance)
+                await db.exec(update(model).where(model.id == instance.id).values(**values))
+            db.add_all(rows)
+            await db.commit()
+
+        for instance, values in self.transitions:
+            for key, value in values.items():
+                set_committed_value(instance, key, value)
+        for callback in self._on_commit:
+            callback()
+
+        self.rows = []
+        self.transitions = []
+        self._on_commit = []
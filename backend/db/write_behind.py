@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from collections import defaultdict
+from typing import Hashable, List, Optional
+from sqlalchemy.exc import OperationalError, InterfaceError
+from sqlmodel import SQLModel, insert
+from db.database import AsyncSessionLocal
+from db.models import ThreadMessage, ThreadTaskMemoryEntry, LLMUsageRecord
+
+
+# 'sync': message/memory rows are written in the step's own transaction.
+# 'async': they are handed to the write-behind queue and the step returns without waiting for them.
+# Single worker only, see start_message_log_queue.
+MESSAGE_LOG_DURABILITY = os.getenv('MESSAGE_LOG_DURABILITY', 'sync')
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the database couldn't be reached rather than that it rejected the rows
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of insert-only rows that a background task writes in batches with multi-row INSERTs.
+    put() waits when the queue is full, so a slow database pushes back on the request handlers instead of
+    growing memory without bound. Rows can be put under a key (e.g. their thread id) to wait for just those.
+
+    While the database is unreachable a batch is retried with backoff and never dropped. A batch the database
+    rejects is retried row by row, so only the offending rows are lost, and those are logged with their data.
+    """
+
+    def __init__(self, models: tuple, max_size: int = 1000, batch_size: int = 100, flush_interval: float = 0.5,
+                 max_retry_delay: float = 30.0):
+        self.models = models
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retry_delay = max_retry_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending = defaultdict(int)
+        self._written: Optional[asyncio.Condition] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def accepts(self, row: SQLModel) -> bool:
+        return self.running and isinstance(row, self.models)
+
+    async def start(self):
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._written = asyncio.Condition()
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, row: SQLModel, key: Optional[Hashable] = None):
+        if key is not None:
+            self._pending[key] += 1
+        await self._queue.put((row, key))
+
+    def offer(self, row: SQLModel) -> bool:
+        """
+        Non-blocking put for callers that can't wait, callable from any thread (e.g. LLM callbacks of tools
+        running in a worker thread). The row is dropped, and False returned, when the queue is full or stopped.
+        """
+        if not self.running:
+            return False
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            return self._put_nowait(row)
+        self._loop.call_soon_threadsafe(self._put_nowait, row)
+        return True
+
+    def _put_nowait(self, row: SQLModel) -> bool:
+        try:
+            self._queue.put_nowait((row, None))
+            return True
+        except asyncio.QueueFull:
+            logger.warning('Write-behind queue full, dropped a %s row', type(row).__name__)
+            return False
+
+    async def flush(self, key: Optional[Hashable] = None):
+        """Wait until the rows queued so far under key, or all of them without a key, have been written."""
+        if not self.running:
+            return
+        if key is None:
+            await self._queue.join()
+            return
+        async with self._written:
+            await self._written.wait_for(lambda: not self._pending.get(key))
+
+    async def stop(self, timeout: float = 30.0):
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.error('Stopping write-behind queue with %s rows still unwritten', self._queue.qsize())
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._write([row for row, _ in batch])
+            finally:
+                for _, key in batch:
+                    if key is not None:
+                        self._pending[key] -= 1
+                        if not self._pending[key]:
+                            del self._pending[key]
+                    self._queue.task_done()
+                async with self._written:
+                    self._written.notify_all()
+
+    async def _write(self, batch: List[SQLModel]):
+        delay = 0.2
+        while True:
+            try:
+                await self._insert(batch)
+                return
+            except TRANSIENT_ERRORS as e:
+                logger.warning('Write-behind flush of %s rows failed, retrying in %.1fs: %s', len(batch), delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+            except Exception:
+                break
+
+        # Rejected by the database: write the rows one by one so only the offending ones are lost
+        for row in batch:
+            try:
+                await self._insert([row])
+            except Exception:
+                logger.exception('Write-behind dropped a %s row the database rejected: %s',
+                                 type(row).__name__, row.model_dump(exclude={'id'}))
+
+    async def _insert(self, batch: List[SQLModel]):
+        async with AsyncSessionLocal() as session:
+            for model in self.models:
+                rows = [row.model_dump(exclude={'id'}) for row in batch if isinstance(row, model)]
+                if rows:
+                    await session.exec(insert(model).values(rows))
+            await session.commit()
+
+
+message_log_queue = WriteBehindQueue(
+    models=(ThreadMessage, ThreadTaskMemoryEntry),
+    max_size=int(os.getenv('MESSAGE_LOG_QUEUE_SIZE', '1000')),
+)
+
+
+def running_multiple_workers() -> bool:
+    """Whether this is one of several server processes (uvicorn --workers N spawns them, or WEB_CONCURRENCY > 1)."""
+    return multiprocessing.parent_process() is not None or int(os.getenv('WEB_CONCURRENCY', '1')) > 1
+
+
+async def start_message_log_queue():
+    """
+    The queue is per process: a step's rows can still be queued in one worker while its thread version (updated_at)
+    is already committed, and the next step served by another worker would reload the agent context without them.
+    So with several workers 'async' is refused and the rows are written in the step's transaction.
+    """
+    if MESSAGE_LOG_DURABILITY != 'async':
+        return
+    if running_multiple_workers():
+        logger.error('MESSAGE_LOG_DURABILITY=async needs a single worker, writing thread messages synchronously')
+        return
+    await message_log_queue.start()
+
+
+# Per call LLM usage (utils/llm_usage.py), always written behind the request. LLM_USAGE_LOGGING=false disables it.
+LLM_USAGE_LOGGING = os.getenv('LLM_USAGE_LOGGING', 'true') == 'true'
+
+llm_usage_queue = WriteBehindQueue(
+    models=(LLMUsageRecord,),
+    max_size=int(os.getenv('LLM_USAGE_QUEUE_SIZE', '5000')),
+)
+
+
+async def start_llm_usage_queue():
+    if LLM_USAGE_LOGGING:
+        await llm_usage_queue.start()
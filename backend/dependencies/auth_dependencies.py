@@ -3,8 +3,8 @@ from utils.auth_helper import decode_token
 from fastapi.security import OAuth2PasswordBearer
 from db.database import get_async_session
 from sqlmodel.ext.asyncio.session import AsyncSession
-from sqlmodel import Session, select
-from db.models import User, LoginSession
+from db.models import User, UserType
+from utils.auth_cache import auth_cache
 from utils.procedures import CustomError
 
 
@@ -14,19 +14,13 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl='apps/auth/login')
 async def get_current_user_dependency(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_session)):
     try:
         payload = decode_token(token)
-        user_id = payload.get('user_id')
 
-        u_query = select(User).where(User.id == user_id)
-        user = (await db.exec(u_query)).first()
-
-        if not user:
+        cached = await auth_cache.get(db, payload.get('session_id'), payload.get('user_id'))
+        if not cached:
             raise CustomError(status_code=status.HTTP_401_UNAUTHORIZED, message='Invalid_Token')
 
-        session_id = payload.get('session_id')
-        s_query = select(LoginSession).where(LoginSession.id == session_id)
-        login_session = (await db.exec(s_query)).first()
-
-        if not login_session or login_session.is_logged_out is True:
+        user, is_logged_out = cached
+        if is_logged_out is True:
             raise CustomError(status_code=status.HTTP_401_UNAUTHORIZED, message='Invalid_Token')
 
         if user.is_blocked is True:
@@ -36,3 +30,9 @@ async def get_current_user_dependency(token: str = Depends(oauth2_scheme), db: A
 
     except Exception:
         raise CustomError(status_code=status.HTTP_401_UNAUTHORIZED, message='Invalid_Token')
+
+
+async def get_admin_user_dependency(user: User = Depends(get_current_user_dependency)):
+    if user.user_type != UserType.ADMIN_USER:
+        raise CustomError(status_code=status.HTTP_403_FORBIDDEN, message='Admins_Only')
+    return user
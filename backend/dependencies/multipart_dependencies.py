@@ -0,0 +1,30 @@
+from fastapi import Form, File, UploadFile
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+from typing import Optional
+from utils.ai_helpers import Screenshot, SCREENSHOT_EXTENSIONS
+
+
+def multipart_screenshot_request(model: type[BaseModel]):
+    """
+    Dependency for the multipart variant of an agent endpoint: the request body (as JSON) in the `payload`
+    form field and the screenshot as raw bytes in the `screenshot` file part, instead of base64 in the JSON.
+    Resolves to (request, screenshot), screenshot falls back to the payload's screenshot_b64 when no file is sent.
+    """
+
+    async def dependency(payload: str = Form(...),
+                         screenshot: Optional[UploadFile] = File(None)) -> tuple[BaseModel, Optional[Screenshot]]:
+        try:
+            request = model.model_validate_json(payload)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+
+        if screenshot is None:
+            return request, Screenshot.from_b64(request.screenshot_b64, request.screenshot_media_type)
+
+        media_type = screenshot.content_type
+        if media_type not in SCREENSHOT_EXTENSIONS:
+            media_type = request.screenshot_media_type
+        return request, Screenshot(media_type, data=await screenshot.read())
+
+    return dependency
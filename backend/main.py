@@ -1,6 +1,7 @@
 import datetime
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST
 from fastapi.middleware.cors import CORSMiddleware
 from routers.apps.auth import router as userauth_router
 from routers.aiagent.generic import router as aiagent_router
@@ -9,7 +10,16 @@ from routers.aiagent.suggestor import router as suggestor_aiagent_router
 from routers.aiagent.background import router as bg_mode_aiagent_router
 from routers.apps.threads_ws import ws_router as threads_ws_router, broadcast, init_redis
 from routers.apps.desktop import router as desktop_router
+from routers.apps.admin import router as admin_router
 from utils.procedures import CustomError
+from db.write_behind import message_log_queue, start_message_log_queue, llm_usage_queue, start_llm_usage_queue
+from utils.screenshot_uploader import screenshot_uploader
+from utils.upload_helper import shutdown_thumbnail_executor
+from utils.auth_cache import auth_cache, init_auth_cache
+from utils.shared_redis import connect_shared_redis, close_shared_redis
+from utils import llm_provider
+from utils.metrics import metrics_middleware, render_metrics, start_resource_metrics, stop_resource_metrics
+from utils.pagination import NEXT_CURSOR_HEADER
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -26,8 +36,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=['*'],
     allow_headers=['*'],
+    expose_headers=[NEXT_CURSOR_HEADER, 'ETag'],
 )
 
+app.middleware('http')(metrics_middleware)
+
 
 @app.exception_handler(CustomError)
 async def custom_http_exception_handler(request: Request, exc: CustomError):
@@ -44,17 +57,36 @@ app.include_router(bg_mode_aiagent_router)
 app.include_router(aiagent_router)
 app.include_router(threads_ws_router)
 app.include_router(desktop_router)
+app.include_router(admin_router)
 
 @app.on_event('startup')
 async def startup():
     await init_redis()  # From threads_ws.py
+    await init_auth_cache()
+    await connect_shared_redis()
+    await start_message_log_queue()
+    await start_llm_usage_queue()
+    start_resource_metrics()
+    await llm_provider.prewarm_llms()
 
 @app.on_event('shutdown')
 async def shutdown():
+    await message_log_queue.stop()
+    await llm_usage_queue.stop()
+    await screenshot_uploader.stop()
+    shutdown_thumbnail_executor()
+    await auth_cache.close()
+    await close_shared_redis()
     if broadcast:
         await broadcast.disconnect()
+    await stop_resource_metrics()
 
 
 @app.get('/')
 async def index():
     return {'message': datetime.datetime.now()}
+
+
+@app.get('/metrics')
+async def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
@@ -1,23 +1,26 @@
 from fastapi import APIRouter, Depends, status
+from typing import Optional
 from sqlmodel import select, and_
 from sqlmodel.ext.asyncio.session import AsyncSession
-from db.database import get_async_session
-from langchain_core.messages import SystemMessage, HumanMessage
+from db.database import get_async_session, release_connection
+from db.unit_of_work import StepUnitOfWork
 from langchain_core.prompts import ChatPromptTemplate
 import json
 from utils import ai_prompts
 from utils.procedures import CustomError, extract_json
 from dependencies.auth_dependencies import get_current_user_dependency
+from dependencies.multipart_dependencies import multipart_screenshot_request
 from db.models import (User, Thread, ThreadStatus, ThreadTask, ThreadTaskStatus, ThreadMessage,
                        ThreadChatType, ThreadChatFromChoices, ThreadTaskMemoryEntry)
 from schemas.aiagent import BackgroundNextStepRequest
 from utils.agentic_tools import run_tool_server_side_async
 from utils import llm_provider
-from base64 import b64decode
-import io
+from utils.ai_helpers import astream_with_thinking, thinking_text_from_block, screenshot_message_block, Screenshot
+from utils.prompt_cache import build_cached_messages, report_usage
 import os
-from utils import upload_helper
-import asyncio
+from utils.screenshot_uploader import screenshot_uploader
+from utils.llm_usage import set_llm_usage_context
+from utils.metrics import start_step_timings
 import datetime
 from routers.apps.threads_ws import (
     broadcast_agent_action, 
@@ -37,6 +40,23 @@ router = APIRouter(
 async def next_step(tid: str, next_step_req: BackgroundNextStepRequest, 
                     db: AsyncSession = Depends(get_async_session),
                     user: User = Depends(get_current_user_dependency)):
+    screenshot = Screenshot.from_b64(next_step_req.screenshot_b64, next_step_req.screenshot_media_type)
+    return await run_background_step(tid, next_step_req, screenshot, db, user)
+
+
+@router.post('/{tid}/next_step/multipart')
+async def next_step_multipart(tid: str,
+                              step_request: tuple = Depends(multipart_screenshot_request(BackgroundNextStepRequest)),
+                              db: AsyncSession = Depends(get_async_session),
+                              user: User = Depends(get_current_user_dependency)):
+    """next_step with the screenshot sent as a binary file part next to the JSON `payload` field."""
+    next_step_req, screenshot = step_request
+    return await run_background_step(tid, next_step_req, screenshot, db, user)
+
+
+async def run_background_step(tid: str, next_step_req: BackgroundNextStepRequest, screenshot: Optional[Screenshot],
+                              db: AsyncSession, user: User) -> dict:
+    timings = start_step_timings('background_next_step')
     result = await db.exec(select(Thread).where(and_(
         Thread.id == tid,
         Thread.user_id == user.id,
@@ -56,10 +76,10 @@ async def next_step(tid: str, next_step_req: BackgroundNextStepRequest,
     if not task:
         raise CustomError(status.HTTP_404_NOT_FOUND, 'Thread has no running task')
 
-    if task.extended_thinking_mode is True:
-        llm = llm_provider.get_llm(agent='computer_use', temperature=1.0, thinking_enabled=True)
-    else:
-        llm = llm_provider.get_llm(agent='computer_use', temperature=0.0)
+    set_llm_usage_context(user_id=user.id, thread_id=instance.id, thread_task_id=task.id,
+                          agent_aliases={'computer_use': 'background'})
+
+    llm = llm_provider.get_agent_llm('computer_use', 'thinking' if task.extended_thinking_mode is True else 'default')
 
     result = await db.exec(select(ThreadTask).where(and_(
         ThreadTask.thread.has(Thread.user_id == user.id),
@@ -74,35 +94,16 @@ async def next_step(tid: str, next_step_req: BackgroundNextStepRequest,
             'status': previous_task.status,
         })
 
+    timings.lap('db_load')
+
     screenshot_user_message_block = None
-    screenshot_s3_path = None
-    if next_step_req.screenshot_b64:
+    screenshot_upload = None
+    if screenshot is not None:
         if os.getenv('ENABLE_SCREENSHOT_LOGGING_FOR_TRAINING') == 'true':
-            image_bytes = b64decode(next_step_req.screenshot_b64)
-            image_io = io.BytesIO(image_bytes)
-            # Use async version or thread pool
-            screenshot_s3_path = await asyncio.to_thread(
-                upload_helper.upload_screenshot_s3_bytesio,
-                image_io,
-                extension="png"
-            )
-            # Or if you have async version:
-            # screenshot_s3_path = await upload_helper.upload_screenshot_s3_bytesio_async(image_io, extension="png")
-        
-        if os.getenv('COMPUTER_USE_AGENT_MODEL_TYPE') == 'ollama' or os.getenv('COMPUTER_USE_AGENT_MODEL_TYPE') == 'gemini':
-            screenshot_user_message_block = {
-                "type": "image_url",
-                "image_url": f"data:image/png;base64,{next_step_req.screenshot_b64}"
-            }
-        else:
-            screenshot_user_message_block = {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/png",
-                    "data": next_step_req.screenshot_b64
-                }
-            }
+            screenshot_upload = screenshot_uploader.submit(screenshot.data, extension=screenshot.extension)
+            timings.lap('screenshot_upload')
+
+        screenshot_user_message_block = screenshot_message_block('computer_use', screenshot)
 
     action_history = []
     result = await db.exec(
@@ -142,6 +143,7 @@ async def next_step(tid: str, next_step_req: BackgroundNextStepRequest,
             ThreadTaskMemoryEntry.thread_task_id == task.id
         ))
         memory_items = result.all()
+    timings.lap('db_load')
 
     memory_items_arr = []
     for memory_item in memory_items:
@@ -149,7 +151,9 @@ async def next_step(tid: str, next_step_req: BackgroundNextStepRequest,
             'memory_item_text': memory_item.text,
         })
 
-    computer_use_user_message = [
+    # Blocks that stay the same from one step to the next come first, so they can be served from the
+    # provider's prompt cache together with the system prompt
+    stable_blocks = [
         {
             'type': 'text',
             'text': f"Today's date: {datetime.datetime.now().strftime('%Y-%m-%d')}"
@@ -158,6 +162,19 @@ async def next_step(tid: str, next_step_req: BackgroundNextStepRequest,
             'type': 'text',
             'text': f'Current Task: {task.task_text}'
         },
+    ]
+    if len(previous_tasks_arr) > 0:
+        stable_blocks.append({
+            'type': 'text',
+            'text': f'Previous Tasks: \n {json.dumps(previous_tasks_arr)}'
+        })
+    if len(memory_items_arr) > 0:
+        stable_blocks.append({
+            'type': 'text',
+            'text': f'Stored Memory Items: \n {json.dumps(memory_items_arr)}'
+        })
+
+    dynamic_blocks = [
         {
             'type': 'text',
             'text': f'Current URL: {next_step_req.current_url}'
@@ -167,60 +184,56 @@ async def next_step(tid: str, next_step_req: BackgroundNextStepRequest,
             'text': f'Current Open Tabs: {json.dumps(next_step_req.current_open_tabs)}'
         }
     ]
-
-    if len(memory_items_arr) > 0:
-        computer_use_user_message.append({
-            'type': 'text',
-            'text': f'Stored Memory Items: \n {json.dumps(memory_items_arr)}'
-        })
     if len(action_history) > 0:
-        computer_use_user_message.append({
+        dynamic_blocks.append({
             'type': 'text',
             'text': f'Your Most Recent Actions (Limited to 5, newest first) These are the actions you most recently took (you must take those into consideration when evaluating the current state and the next goal):\n {json.dumps(action_history)}'
         })
-    if len(previous_tasks_arr) > 0:
-        computer_use_user_message.append({
-            'type': 'text',
-            'text': f'Previous Tasks: \n {json.dumps(previous_tasks_arr)}'
-        })
     
-    computer_use_text_prompt = computer_use_user_message.copy()
+    computer_use_text_prompt = stable_blocks + dynamic_blocks
     
     if screenshot_user_message_block:
-        computer_use_user_message.append(screenshot_user_message_block)
+        dynamic_blocks.append(screenshot_user_message_block)
 
-    prompt = ChatPromptTemplate.from_messages([
-        SystemMessage(content=ai_prompts.BG_MODE_BROWSER_AGENT_PROMPT),
-        HumanMessage(content=computer_use_user_message),
-    ])
+    prompt = ChatPromptTemplate.from_messages(build_cached_messages(
+        'computer_use', ai_prompts.BG_MODE_BROWSER_AGENT_PROMPT, stable_blocks, dynamic_blocks,
+    ))
+
+    # Context is loaded, give the connection back before the (slow) LLM call. Results are persisted
+    # afterwards in short transactions that check a connection out again.
+    await release_connection(db)
+    timings.lap('prompt_build')
 
     chain = prompt | llm
-    response = await chain.ainvoke({})
+    if task.extended_thinking_mode is True:
+        # Thinking is published line by line while the model is still generating
+        response = await astream_with_thinking(chain, {}, lambda line: broadcast_agent_thinking(tid, line))
+    else:
+        response = await chain.ainvoke({})
+    timings.lap('llm')
 
-    print('Token Usage: ', response.usage_metadata)
+    report_usage('computer_use', response.usage_metadata)
+
+    # Everything this step writes is collected here and committed once at the end
+    uow = StepUnitOfWork()
 
     response_data = None
-    if task.extended_thinking_mode is True:
+    if isinstance(response.content, list):
         for response_item in response.content:
-            if response_item.get('type') == 'reasoning_content':
-                thinking_text = response_item.get('reasoning_content', {}).get('text', '')
-                if thinking_text:
-                    await broadcast_agent_thinking(tid, thinking_text)
-                
-                thinking_message = ThreadMessage(
+            thinking_text = thinking_text_from_block(response_item)
+            if thinking_text is not None:
+                uow.add(ThreadMessage(
                     thread_id=instance.id,
                     thread_task_id=task.id,
                     thread_chat_type=ThreadChatType.THINKING,
                     thread_chat_from=ThreadChatFromChoices.FROM_AI,
                     chain_of_thought=thinking_text,
-                )
-                db.add(thinking_message)
-                await db.commit()
-                await db.refresh(thinking_message)
+                ))
             elif response_item.get('type') == 'text':
                 response_data = extract_json(response_item.get('text'))
     else:
         response_data = extract_json(response.content)
+    timings.lap('parse')
     
     current_state = response_data.get('current_state', {})
     if current_state.get('next_goal'):
@@ -228,29 +241,23 @@ async def next_step(tid: str, next_step_req: BackgroundNextStepRequest,
             "message": f"Action: {current_state.get('next_goal')}"
         })
 
-    ai_message = ThreadMessage(
+    uow.add(ThreadMessage(
         thread_id=instance.id,
         thread_task_id=task.id,
         thread_chat_type=ThreadChatType.BACKGROUND_MODE_BROWSER,
         thread_chat_from=ThreadChatFromChoices.FROM_AI,
-        screenshot=screenshot_s3_path,
+        screenshot=screenshot_uploader.attach(screenshot_upload, uow),
         prompt=json.dumps(computer_use_text_prompt),
         text=json.dumps(response_data),
-    )
-    db.add(ai_message)
-    await db.commit()
-    await db.refresh(ai_message)
+    ))
 
     if response_data.get('current_state', {}).get('save_to_memory', False):
         memory_text = response_data['current_state'].get('memory')
         if memory_text:
-            memory_entry = ThreadTaskMemoryEntry(
+            uow.add(ThreadTaskMemoryEntry(
                 thread_task_id=task.id,
                 text=memory_text,
-            )
-            db.add(memory_entry)
-            await db.commit()
-            await db.refresh(memory_entry)
+            ))
 
     # Iterate over all actions
     actions_arr = response_data.get('actions', [])
@@ -264,52 +271,16 @@ async def next_step(tid: str, next_step_req: BackgroundNextStepRequest,
                 "message": "Task completed successfully."
             })
 
-            task.status = ThreadTaskStatus.COMPLETED
-            db.add(task)
-            await db.commit()
-            await db.refresh(task)
-
-            instance.status = ThreadStatus.STANDBY
-            db.add(instance)
-            await db.commit()
-            await db.refresh(instance)
-
-            # ai_message = ThreadMessage(
-            #     thread_id=instance.id,
-            #     thread_task_id=task.id,
-            #     thread_chat_type=ThreadChatType.BACKGROUND_MODE_BROWSER,
-            #     thread_chat_from=ThreadChatFromChoices.FROM_AI,
-            #     text=json.dumps({'actions': [{'action': 'task_completed'}]}),
-            # )
-            # db.add(ai_message)
-            # await db.commit()
-            # await db.refresh(ai_message)
+            uow.transition(task, status=ThreadTaskStatus.COMPLETED)
+            uow.transition(instance, status=ThreadStatus.STANDBY)
 
         elif action_type == 'task_failed':
             await broadcast_task_status_update(tid, "task_failed", {
                 "message": f"Task failed: {task.task_text}"
             })
-            
-            task.status = ThreadTaskStatus.FAILED
-            db.add(task)
-            await db.commit()
-            await db.refresh(task)
-
-            instance.status = ThreadStatus.STANDBY
-            db.add(instance)
-            await db.commit()
-            await db.refresh(instance)
-
-            # ai_message = ThreadMessage(
-            #     thread_id=instance.id,
-            #     thread_task_id=task.id,
-            #     thread_chat_type=ThreadChatType.BACKGROUND_MODE_BROWSER,
-            #     thread_chat_from=ThreadChatFromChoices.FROM_AI,
-            #     text=json.dumps({'actions': [{'action': 'task_failed'}]}),
-            # )
-            # db.add(ai_message)
-            # await db.commit()
-            # await db.refresh(ai_message)
+
+            uow.transition(task, status=ThreadTaskStatus.FAILED)
+            uow.transition(instance, status=ThreadStatus.STANDBY)
 
         elif action_type == 'tool_use':
             tool = act['params'].get('tool')
@@ -322,30 +293,20 @@ async def next_step(tid: str, next_step_req: BackgroundNextStepRequest,
             })
 
             if tool == 'save_to_memory':
-                memory_entry = ThreadTaskMemoryEntry(
+                uow.add(ThreadTaskMemoryEntry(
                     thread_task_id=task.id,
                     text=args.get('text', ''),
-                )
-                db.add(memory_entry)
-                await db.commit()
-                await db.refresh(memory_entry)
+                ))
 
             elif tool in ['read_pdf', 'fetch_url', 'summarize_youtube_video']:
-                # Use async version if available, or run in thread pool
-                tool_output_text = await asyncio.to_thread(
-                    run_tool_server_side,
-                    tool,
-                    args
-                )
-                # Or if you have async version:
-                # tool_output_text = await run_tool_server_side_async(tool, args)
-                
-                memory_entry = ThreadTaskMemoryEntry(
+                uow.add(ThreadTaskMemoryEntry(
                     thread_task_id=task.id,
-                    text=tool_output_text,
-                )
-                db.add(memory_entry)
-                await db.commit()
-                await db.refresh(memory_entry)
+                    text=await run_tool_server_side_async(tool, args),
+                ))
+    timings.lap('tools')
+
+    await uow.commit(db)
+    timings.lap('persist')
+    timings.observe()
 
     return response_data
@@ -1,29 +1,35 @@
-from fastapi import APIRouter, Depends, UploadFile, File, status
+from fastapi import APIRouter, Depends, UploadFile, File, Response, status
+from fastapi.responses import StreamingResponse
 from sqlmodel import select, and_
 from sqlmodel.ext.asyncio.session import AsyncSession
-from db.database import get_async_session
+from db.database import get_async_session, release_connection, AsyncSessionLocal
+from db.unit_of_work import StepUnitOfWork
 from typing import Optional
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from utils import constants
-from botocore.config import Config
-from langchain_aws import ChatBedrockConverse
-from langchain_openai import AzureChatOpenAI
 import json
 from utils import ai_prompts
-from utils.procedures import CustomError, extract_json, extract_json_array
+from utils.procedures import CustomError, extract_json, extract_json_array, IncrementalActionParser
 from dependencies.auth_dependencies import get_current_user_dependency
+from dependencies.multipart_dependencies import multipart_screenshot_request
 from db.models import (User, Thread, ThreadStatus, ThreadTask, ThreadTaskStatus, ThreadMessage,
                        ThreadChatType, ThreadChatFromChoices, ThreadTaskPlan, ThreadTaskPlanStatus,
                        PlanSubtask, SubtaskStatus, ThreadTaskMemoryEntry, SubtaskType)
 from schemas.aiagent import NextStepRequest, CurrentSubtaskRequestObj
 from utils.agentic_tools import run_tool_server_side_async
 from utils import llm_provider
-from base64 import b64decode
-import io
+from utils.ai_helpers import astream_with_thinking, thinking_text_from_block, screenshot_message_block, Screenshot
+from utils.prompt_cache import build_cached_messages, report_usage
+from utils.ui_encoding import encode_interactive_elements
+from utils.ui_state import ui_state_store, last_screenshot_cache, get_ui_prompt_mode
 import os
-from utils import upload_helper
+from utils.screenshot_uploader import ScreenshotUpload, screenshot_uploader
+from utils.agent_context import agent_context_cache, AgentContext
+from utils.llm_usage import set_llm_usage_context
+from utils.metrics import start_step_timings, StepTimings
 import datetime
+import asyncio
 from routers.apps.threads_ws import (
     broadcast_agent_action, 
     broadcast_agent_thinking, 
@@ -44,6 +50,7 @@ router = APIRouter(
 async def current_subtask_request(tid: str, current_subtask_request_obj: CurrentSubtaskRequestObj,
                             db: AsyncSession = Depends(get_async_session), 
                             user: User = Depends(get_current_user_dependency)):
+    timings = start_step_timings('current_subtask')
     result = await db.exec(select(Thread).where(and_(
         Thread.id == tid,
         Thread.user_id == user.id,
@@ -54,28 +61,24 @@ async def current_subtask_request(tid: str, current_subtask_request_obj: Current
     if not instance:
         raise CustomError(status.HTTP_404_NOT_FOUND, 'Thread not found')
 
-    result = await db.exec(select(ThreadTask).where(and_(
-        ThreadTask.thread_id == tid,
-        ThreadTask.status == ThreadTaskStatus.WORKING,
-    )))
-    task = result.first()
+    context = await agent_context_cache.get(db, instance, user)
 
-    if not task:
+    if not context:
         raise CustomError(status.HTTP_404_NOT_FOUND, 'Thread has no running task')
 
-    result = await db.exec(select(ThreadTaskPlan).where(and_(
-        ThreadTaskPlan.thread_task_id == task.id,
-        ThreadTaskPlan.status == ThreadTaskPlanStatus.ACTIVE,
-    )))
-    current_plan = result.first()
+    task = context.task
+    current_plan = context.plan
+    timings.lap('db_load')
 
     if not current_plan:
+        set_llm_usage_context(user_id=user.id, thread_id=instance.id, thread_task_id=task.id)
         result = await db.exec(select(ThreadTask).where(and_(
             ThreadTask.thread.has(Thread.user_id == user.id),
             ThreadTask.thread.has(Thread.status != ThreadStatus.DELETED),
             ThreadTask.status != ThreadTaskStatus.WORKING,
         )).order_by(ThreadTask.created_at.desc()).limit(10))
         previous_tasks = result.all()
+        timings.lap('db_load')
         
         previous_tasks_arr = []
         for previous_task in previous_tasks:
@@ -84,12 +87,12 @@ async def current_subtask_request(tid: str, current_subtask_request_obj: Current
                 'status': previous_task.status,
             })
 
-        llm = llm_provider.get_llm(agent='planner', temperature=0.3)
+        llm = llm_provider.get_agent_llm('planner')
 
         plan_user_message = [
             {
                 'type': 'text',
-                'text': f'Current OS: {current_subtask_request_obj.current_os} \n\nCurrent Visible OS Native Interactive Elements: {json.dumps(current_subtask_request_obj.current_interactive_elements)}'
+                'text': f'Current OS: {current_subtask_request_obj.current_os} \n\nCurrent Visible OS Native Interactive Elements: {encode_interactive_elements('planner', current_subtask_request_obj.current_interactive_elements)}'
             },
             {
                 'type': 'text',
@@ -113,89 +116,86 @@ async def current_subtask_request(tid: str, current_subtask_request_obj: Current
             HumanMessage(content=plan_user_message),
         ])
 
+        # Phase split: don't hold a pooled connection while the planner is thinking
+        await release_connection(db)
+        timings.lap('prompt_build')
+
         chain = plan_prompt | llm
         plan_response = await chain.ainvoke({})
+        timings.lap('llm')
         plan_response_data = extract_json(plan_response.content)
+        timings.lap('parse')
 
         plan = plan_response_data.get('subtasks')
 
-        plan_ai_message = ThreadMessage(
+        uow = StepUnitOfWork()
+        uow.add(ThreadMessage(
             thread_id=instance.id,
             thread_chat_type=ThreadChatType.PLAN,
             thread_chat_from=ThreadChatFromChoices.FROM_AI,
             text=json.dumps(plan_response_data),
-        )
-        db.add(plan_ai_message)
-        await db.commit()
-        await db.refresh(plan_ai_message)
+        ))
 
-        current_plan = ThreadTaskPlan(
+        current_plan = uow.add(ThreadTaskPlan(
             thread_task_id=task.id,
-        )
-        db.add(current_plan)
-        await db.commit()
-        await db.refresh(current_plan)
+        ))
 
         plan_str = ''
+        subtasks = []
 
         for i, subtask_item in enumerate(plan):
             plan_str += f'{'\n' if i != 0 else ''}{i + 1}) {subtask_item.get('subtask')}'
+            # Linked through the relationship so the plan and its subtasks go out in the same flush
             subtask = PlanSubtask(
-                thread_task_plan_id=current_plan.id,
+                plan=current_plan,
                 subtask_text=subtask_item.get('subtask'),
                 subtask_type=SubtaskType.DESKTOP,
                 # subtask_type=SubtaskType.DESKTOP if subtask_item.get(
                 #     'type') == 'desktop_subtask' else SubtaskType.BROWSER,
                 ordering=i + 1,
             )
-            db.add(subtask)
-            await db.commit()
-            await db.refresh(subtask)
+            subtasks.append(uow.add(subtask))
+
+        context.bump_version(uow, instance)
+        await uow.commit(db)
+        timings.lap('persist')
+
+        for instance_to_cache in [current_plan, *subtasks]:
+            db.expunge(instance_to_cache)
+        context.set_plan(current_plan, subtasks)
         
         await broadcast_task_status_update(tid, "planning", {
             "message": f"Plan: {plan_str}"
         })
 
-    result = await db.exec(select(PlanSubtask).where(and_(
-        PlanSubtask.status == SubtaskStatus.ACTIVE,
-        PlanSubtask.thread_task_plan_id == current_plan.id
-    )).order_by(PlanSubtask.ordering.asc()))
-    current_subtask = result.first()
+    current_subtask = context.current_subtask
 
     if not current_subtask:
+        agent_context_cache.invalidate(tid)
+
         await broadcast_task_status_update(tid, "task_completed", {
             "message": "All subtasks completed! Task finished successfully."
         })
-        
-        current_plan.status = ThreadTaskPlanStatus.COMPLETED
-        db.add(current_plan)
-        await db.commit()
-        await db.refresh(current_plan)
-
-        task.status = ThreadTaskStatus.COMPLETED
-        db.add(task)
-        await db.commit()
-        await db.refresh(task)
-
-        instance.status = ThreadStatus.STANDBY
-        db.add(instance)
-        await db.commit()
-        await db.refresh(instance)
-
-        ai_message = ThreadMessage(
+
+        uow = StepUnitOfWork()
+        uow.transition(current_plan, status=ThreadTaskPlanStatus.COMPLETED)
+        uow.transition(task, status=ThreadTaskStatus.COMPLETED)
+        uow.transition(instance, status=ThreadStatus.STANDBY)
+        uow.add(ThreadMessage(
             thread_id=instance.id,
             thread_task_id=task.id,
             thread_chat_type=ThreadChatType.DESKTOP_USE,
             thread_chat_from=ThreadChatFromChoices.FROM_AI,
             text=json.dumps({'actions': [{'action': 'task_completed'}]}),
-        )
-        db.add(ai_message)
-        await db.commit()
-        await db.refresh(ai_message)
+        ))
+        await uow.commit(db)
+        timings.lap('persist')
+        timings.observe()
 
         return {'action': 'task_completed'}
     
     # await broadcast_subtask_start(tid, current_subtask.subtask_text)
+    timings.observe()
 
     return {
         'id': current_subtask.id,
@@ -205,10 +205,31 @@ async def current_subtask_request(tid: str, current_subtask_request_obj: Current
     }
 
 
-@router.post('/{tid}/next_step')
-async def next_step(tid: str, next_step_req: NextStepRequest, 
-                    db: AsyncSession = Depends(get_async_session),
-                    user: User = Depends(get_current_user_dependency)):
+class NextStepRun:
+    """What prepare_next_step hands to finalize_next_step, everything needed to persist one step's response."""
+
+    def __init__(self, tid: str, thread: Thread, context: AgentContext, current_subtask: PlanSubtask, chain,
+                 text_prompt: list, screenshot_upload: Optional[ScreenshotUpload], ui_snapshot_id: str,
+                 timings: StepTimings):
+        self.tid = tid
+        self.thread = thread
+        self.context = context
+        self.current_subtask = current_subtask
+        self.chain = chain
+        self.text_prompt = text_prompt
+        self.screenshot_upload = screenshot_upload
+        self.ui_snapshot_id = ui_snapshot_id
+        self.timings = timings
+
+    @property
+    def extended_thinking(self) -> bool:
+        return self.context.task.extended_thinking_mode is True
+
+
+async def prepare_next_step(tid: str, next_step_req: NextStepRequest, screenshot: Optional[Screenshot],
+                            db: AsyncSession, user: User) -> NextStepRun:
+    """Loads the step's context and builds the computer use prompt, then releases the DB connection."""
+    timings = start_step_timings('next_step')
     result = await db.exec(select(Thread).where(and_(
         Thread.id == tid,
         Thread.user_id == user.id,
@@ -219,117 +240,65 @@ async def next_step(tid: str, next_step_req: NextStepRequest,
     if not instance:
         raise CustomError(status.HTTP_404_NOT_FOUND, 'Thread not found')
 
-    result = await db.exec(select(ThreadTask).where(and_(
-        ThreadTask.thread_id == tid,
-        ThreadTask.status == ThreadTaskStatus.WORKING,
-    )))
-    task = result.first()
+    context = await agent_context_cache.get(db, instance, user)
 
-    if not task:
+    if not context:
         raise CustomError(status.HTTP_404_NOT_FOUND, 'Thread has no running task')
 
-    result = await db.exec(select(ThreadTaskPlan).where(and_(
-        ThreadTaskPlan.thread_task_id == task.id,
-        ThreadTaskPlan.status == ThreadTaskPlanStatus.ACTIVE,
-    )))
-    current_plan = result.first()
-
-    result = await db.exec(select(PlanSubtask).where(and_(
-        PlanSubtask.status == SubtaskStatus.ACTIVE,
-        PlanSubtask.thread_task_plan_id == current_plan.id
-    )).order_by(PlanSubtask.ordering.asc()))
-    current_subtask = result.first()
+    task = context.task
+    current_subtask = context.current_subtask
     
     if not current_subtask or current_subtask.subtask_type != SubtaskType.DESKTOP:
         raise CustomError(status.HTTP_404_NOT_FOUND, 'No Current Desktop Task!')
 
-    if task.extended_thinking_mode is True:
-        llm = llm_provider.get_llm(agent='computer_use', temperature=1.0, thinking_enabled=True)
-    else:
-        llm = llm_provider.get_llm(agent='computer_use', temperature=0.0)
+    set_llm_usage_context(user_id=user.id, thread_id=instance.id, thread_task_id=task.id,
+                          plan_subtask_id=current_subtask.id)
+
+    ui_snapshot = await ui_state_store.apply(tid, next_step_req.current_interactive_elements, next_step_req.ui_delta)
+    if not ui_snapshot:
+        raise CustomError(status.HTTP_409_CONFLICT, 'UI snapshot is out of date, send the full UI state')
+
+    llm = llm_provider.get_agent_llm('computer_use', 'thinking' if task.extended_thinking_mode is True else 'default')
 
-    result = await db.exec(select(PlanSubtask).where(and_(
-        PlanSubtask.status != SubtaskStatus.ACTIVE,
-        PlanSubtask.plan.has(ThreadTaskPlan.thread_task_id == task.id)
-    )).order_by(PlanSubtask.ordering.asc()))
-    previous_subtasks = result.all()
-    
     previous_subtasks_arr = []
-    for previous_subtask in previous_subtasks:
+    for previous_subtask in context.previous_subtasks:
         previous_subtasks_arr.append({
             'subtask_text': previous_subtask.subtask_text,
             'status': previous_subtask.status,
         })
 
+    # Context is loaded, give the connection back before the slow part of the step (screenshot upload, LLM call).
+    # Results are persisted afterwards in short transactions that check a connection out again.
+    await release_connection(db)
+    timings.lap('db_load')
+
     screenshot_user_message_block = None
-    screenshot_s3_path = None
-    if next_step_req.screenshot_b64:
+    screenshot_upload = None
+    if screenshot is not None:
+        await last_screenshot_cache.set(tid, screenshot)
         if os.getenv('ENABLE_SCREENSHOT_LOGGING_FOR_TRAINING') == 'true':
-            image_bytes = b64decode(next_step_req.screenshot_b64)
-            image_io = io.BytesIO(image_bytes)
-            screenshot_s3_path = await upload_helper.upload_screenshot_s3_bytesio_async(image_io, extension="png")
-        
-        if os.getenv('COMPUTER_USE_AGENT_MODEL_TYPE') == 'ollama' or os.getenv('COMPUTER_USE_AGENT_MODEL_TYPE') == 'gemini':
-            screenshot_user_message_block = {
-                "type": "image_url",
-                "image_url": f"data:image/png;base64,{next_step_req.screenshot_b64}"
-            }
-        else:
-            screenshot_user_message_block = {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/png",
-                    "data": next_step_req.screenshot_b64
-                }
-            }
+            screenshot_upload = screenshot_uploader.submit(screenshot.data, extension=screenshot.extension)
+            timings.lap('screenshot_upload')
+    elif next_step_req.screenshot_unchanged:
+        # The screen looks the same as in the last screenshot the agent sent, give the model that one again
+        screenshot = await last_screenshot_cache.get(tid)
+        if screenshot is None:
+            raise CustomError(status.HTTP_409_CONFLICT, 'No previous screenshot for this thread, send the screenshot')
 
-    action_history = []
-    result = await db.exec(
-        select(ThreadMessage)
-        .where(
-            and_(
-                ThreadMessage.thread_task_id == task.id,
-                ThreadMessage.thread_chat_type == ThreadChatType.DESKTOP_USE,
-            )
-        )
-        .order_by(ThreadMessage.created_at.desc())
-        .limit(5)
-    )
-    task_previous_messages = result.all()
-    
-    for previous_message in task_previous_messages:
-        previous_action_dict = json.loads(previous_message.text)
-        # previous_action_dict.pop("current_state", None)
-        action_history.append(previous_action_dict)
+    if screenshot is not None:
+        screenshot_user_message_block = screenshot_message_block('computer_use', screenshot)
 
-    if task.needs_memory_from_previous_tasks is True:
-        result = await db.exec(select(ThreadTask).where(and_(
-            ThreadTask.thread.has(Thread.user_id == user.id),
-            ThreadTask.thread.has(Thread.status != ThreadStatus.DELETED),
-        )).order_by(ThreadTask.created_at.desc()).limit(5))
-        tasks_for_memory = result.all()
-        
-        tasks_for_memory_ids = [task.id for task in tasks_for_memory]
-        result = await db.exec(
-            select(ThreadTaskMemoryEntry).where(
-                ThreadTaskMemoryEntry.thread_task_id.in_(tasks_for_memory_ids)
-            )
-        )
-        memory_items = result.all()
-    else:
-        result = await db.exec(select(ThreadTaskMemoryEntry).where(
-            ThreadTaskMemoryEntry.thread_task_id == task.id
-        ))
-        memory_items = result.all()
+    action_history = context.action_history
 
     memory_items_arr = []
-    for memory_item in memory_items:
+    for memory_item_text in context.memory_items:
         memory_items_arr.append({
-            'memory_item_text': memory_item.text,
+            'memory_item_text': memory_item_text,
         })
 
-    computer_use_user_message = [
+    # Blocks that stay the same from one step to the next come first, so they can be served from the
+    # provider's prompt cache together with the system prompt
+    stable_blocks = [
         {
             'type': 'text',
             'text': f"Today's date: {datetime.datetime.now().strftime('%Y-%m-%d')}"
@@ -338,69 +307,95 @@ async def next_step(tid: str, next_step_req: NextStepRequest,
             'type': 'text',
             'text': f'Current Subtask: {current_subtask.subtask_text}'
         },
+    ]
+    if len(previous_subtasks_arr) > 0:
+        stable_blocks.append({
+            'type': 'text',
+            'text': f'Previous Subtasks: \n {json.dumps(previous_subtasks_arr)}'
+        })
+    if len(memory_items_arr) > 0:
+        stable_blocks.append({
+            'type': 'text',
+            'text': f'Stored Memory Items: \n {json.dumps(memory_items_arr)}'
+        })
+
+    if ui_snapshot.changes is not None and get_ui_prompt_mode('computer_use') == 'delta':
+        ui_state_text = f'Changes To The Visible OS Native Interactive Elements Since Your Last Action: {json.dumps(ui_snapshot.changes)}'
+    else:
+        ui_state_text = f"Current Visible OS Native Interactive Elements: {encode_interactive_elements('computer_use', ui_snapshot.element_list())}"
+
+    dynamic_blocks = [
         {
             'type': 'text',
-            'text': f'Current OS: {next_step_req.current_os} \n\nCurrent Visible OS Native Interactive Elements: {json.dumps(next_step_req.current_interactive_elements)}'
+            'text': f'Current OS: {next_step_req.current_os} \n\n{ui_state_text}'
         },
         {
             'type': 'text',
             'text': f'Current Running Apps: {json.dumps(next_step_req.current_running_apps)}'
         }
     ]
-
-    if len(memory_items_arr) > 0:
-        computer_use_user_message.append({
-            'type': 'text',
-            'text': f'Stored Memory Items: \n {json.dumps(memory_items_arr)}'
-        })
     if len(action_history) > 0:
-        computer_use_user_message.append({
+        dynamic_blocks.append({
             'type': 'text',
             'text': f'Your Most Recent Actions (Limited to 5, newest first) These are the actions you most recently took (you must take those into consideration when evaluating the current state and the next goal): \n {json.dumps(action_history)}'
         })
-    if len(previous_subtasks_arr) > 0:
-        computer_use_user_message.append({
-            'type': 'text',
-            'text': f'Previous Subtasks: \n {json.dumps(previous_subtasks_arr)}'
-        })
     
-    computer_use_text_prompt = computer_use_user_message.copy()
+    computer_use_text_prompt = stable_blocks + dynamic_blocks
     
     if screenshot_user_message_block:
-        computer_use_user_message.append(screenshot_user_message_block)
+        dynamic_blocks.append(screenshot_user_message_block)
+
+    prompt = ChatPromptTemplate.from_messages(build_cached_messages(
+        'computer_use', ai_prompts.COMPUTER_USE_SYSTEM_PROMPT, stable_blocks, dynamic_blocks,
+    ))
+    timings.lap('prompt_build')
+
+    return NextStepRun(
+        tid=tid,
+        thread=instance,
+        context=context,
+        current_subtask=current_subtask,
+        chain=prompt | llm,
+        text_prompt=computer_use_text_prompt,
+        screenshot_upload=screenshot_upload,
+        ui_snapshot_id=ui_snapshot.id,
+        timings=timings,
+    )
 
-    prompt = ChatPromptTemplate.from_messages([
-        SystemMessage(content=ai_prompts.COMPUTER_USE_SYSTEM_PROMPT),
-        HumanMessage(content=computer_use_user_message),
-    ])
 
-    chain = prompt | llm
-    response = await chain.ainvoke({})
+async def finalize_next_step(run: NextStepRun, response, db: AsyncSession) -> dict:
+    """Parses the model response, publishes it to the thread and persists the step in one commit."""
+    tid = run.tid
+    instance = run.thread
+    context = run.context
+    task = context.task
+    current_plan = context.plan
+    current_subtask = run.current_subtask
+    timings = run.timings
+    timings.lap('llm')
 
-    print('Token Usage: ', response.usage_metadata)
+    report_usage('computer_use', response.usage_metadata)
+
+    # Everything this step writes is collected here and committed once at the end
+    uow = StepUnitOfWork()
 
     response_data = None
-    if task.extended_thinking_mode is True:
+    if isinstance(response.content, list):
         for response_item in response.content:
-            if response_item.get('type') == 'reasoning_content':
-                thinking_text = response_item.get('reasoning_content', {}).get('text', '')
-                if thinking_text:
-                    await broadcast_agent_thinking(tid, thinking_text)
-                
-                thinking_message = ThreadMessage(
+            thinking_text = thinking_text_from_block(response_item)
+            if thinking_text is not None:
+                uow.add(ThreadMessage(
                     thread_id=instance.id,
                     thread_task_id=task.id,
                     thread_chat_type=ThreadChatType.THINKING,
                     thread_chat_from=ThreadChatFromChoices.FROM_AI,
-                    chain_of_thought=response_item.get('reasoning_content', {}).get('text'),
-                )
-                db.add(thinking_message)
-                await db.commit()
-                await db.refresh(thinking_message)
+                    chain_of_thought=thinking_text,
+                ))
             elif response_item.get('type') == 'text':
                 response_data = extract_json(response_item.get('text'))
     else:
         response_data = extract_json(response.content)
+    timings.lap('parse')
     
     current_state = response_data.get('current_state', {})
     if current_state.get('next_goal'):
@@ -408,30 +403,29 @@ async def next_step(tid: str, next_step_req: NextStepRequest,
             "message": f"Action: {current_state.get('next_goal')}"
         })
 
-    ai_message = ThreadMessage(
+    uow.add(ThreadMessage(
         thread_id=instance.id,
         thread_task_id=task.id,
         plan_subtask_id=current_subtask.id,
         thread_chat_type=ThreadChatType.DESKTOP_USE,
         thread_chat_from=ThreadChatFromChoices.FROM_AI,
-        screenshot=screenshot_s3_path,
-        prompt=json.dumps(computer_use_text_prompt),
+        screenshot=screenshot_uploader.attach(run.screenshot_upload, uow),
+        prompt=json.dumps(run.text_prompt),
         text=json.dumps(response_data),
-    )
-    db.add(ai_message)
-    await db.commit()
-    await db.refresh(ai_message)
+    ))
+    uow.on_commit(lambda: context.record_action(response_data))
+
+    def save_memory(memory_text: str):
+        uow.add(ThreadTaskMemoryEntry(
+            thread_task_id=task.id,
+            text=memory_text,
+        ))
+        uow.on_commit(lambda: context.record_memory(memory_text))
 
     if response_data.get('current_state', {}).get('save_to_memory', False):
         memory_text = response_data['current_state'].get('memory')
         if memory_text:
-            memory_entry = ThreadTaskMemoryEntry(
-                thread_task_id=task.id,
-                text=memory_text,
-            )
-            db.add(memory_entry)
-            await db.commit()
-            await db.refresh(memory_entry)
+            save_memory(memory_text)
 
     # Iterate over all actions
     actions_arr = response_data.get('actions', [])
@@ -443,42 +437,26 @@ async def next_step(tid: str, next_step_req: NextStepRequest,
         if action_type == 'subtask_completed' and len(actions_arr) == 1:
             await broadcast_subtask_complete(tid, current_subtask.subtask_text)
 
-            current_subtask.status = SubtaskStatus.COMPLETED
-            db.add(current_subtask)
-            await db.commit()
-            await db.refresh(current_subtask)
+            uow.transition(current_subtask, status=SubtaskStatus.COMPLETED)
 
         elif action_type == 'subtask_failed':
+            agent_context_cache.invalidate(tid)
+
             await broadcast_task_status_update(tid, "task_failed", {
                 "message": f"Task failed: {current_subtask.subtask_text}"
             })
 
             # Mark plan, task, and thread as failed
-            current_plan.status = ThreadTaskPlanStatus.FAILED
-            db.add(current_plan)
-            await db.commit()
-            await db.refresh(current_plan)
-
-            task.status = ThreadTaskStatus.FAILED
-            db.add(task)
-            await db.commit()
-            await db.refresh(task)
-
-            instance.status = ThreadStatus.STANDBY
-            db.add(instance)
-            await db.commit()
-            await db.refresh(instance)
-
-            ai_message = ThreadMessage(
+            uow.transition(current_plan, status=ThreadTaskPlanStatus.FAILED)
+            uow.transition(task, status=ThreadTaskStatus.FAILED)
+            uow.transition(instance, status=ThreadStatus.STANDBY)
+            uow.add(ThreadMessage(
                 thread_id=instance.id,
                 thread_task_id=task.id,
                 thread_chat_type=ThreadChatType.DESKTOP_USE,
                 thread_chat_from=ThreadChatFromChoices.FROM_AI,
                 text=json.dumps({'actions': [{'action': 'task_failed'}]}),
-            )
-            db.add(ai_message)
-            await db.commit()
-            await db.refresh(ai_message)
+            ))
 
         elif action_type == 'tool_use':
             tool = act['params'].get('tool')
@@ -491,22 +469,149 @@ async def next_step(tid: str, next_step_req: NextStepRequest,
             })
 
             if tool == 'save_to_memory':
-                memory_entry = ThreadTaskMemoryEntry(
-                    thread_task_id=task.id,
-                    text=args.get('text', ''),
-                )
-                db.add(memory_entry)
-                await db.commit()
-                await db.refresh(memory_entry)
+                save_memory(args.get('text', ''))
 
             elif tool in ['read_pdf', 'fetch_url', 'summarize_youtube_video']:
-                tool_output_text = await run_tool_server_side_async(tool, args)
-                memory_entry = ThreadTaskMemoryEntry(
-                    thread_task_id=task.id,
-                    text=tool_output_text,
-                )
-                db.add(memory_entry)
-                await db.commit()
-                await db.refresh(memory_entry)
+                save_memory(await run_tool_server_side_async(tool, args))
+    timings.lap('tools')
+
+    context.bump_version(uow, instance)
+    await uow.commit(db)
+    timings.lap('persist')
+    timings.observe()
 
     return response_data
+
+
+async def answer_next_step(run: NextStepRun, db: AsyncSession) -> dict:
+    if run.extended_thinking:
+        # Thinking is published line by line while the model is still generating
+        llm_response = await astream_with_thinking(run.chain, {}, lambda line: broadcast_agent_thinking(run.tid, line))
+    else:
+        llm_response = await run.chain.ainvoke({})
+
+    return await finalize_next_step(run, llm_response, db)
+
+
+async def record_streamed_actions(run: NextStepRun, actions: list, db: AsyncSession):
+    """
+    Persists the actions a streamed step already sent to the desktop when the full response couldn't be
+    handled, so the next step's action history includes what was performed on the machine.
+    """
+    response_data = {'actions': actions}
+    uow = StepUnitOfWork()
+    uow.add(ThreadMessage(
+        thread_id=run.thread.id,
+        thread_task_id=run.context.task.id,
+        plan_subtask_id=run.current_subtask.id,
+        thread_chat_type=ThreadChatType.DESKTOP_USE,
+        thread_chat_from=ThreadChatFromChoices.FROM_AI,
+        screenshot=screenshot_uploader.attach(run.screenshot_upload, uow),
+        prompt=json.dumps(run.text_prompt),
+        text=json.dumps(response_data),
+    ))
+    uow.on_commit(lambda: run.context.record_action(response_data))
+    run.context.bump_version(uow, run.thread)
+    await uow.commit(db)
+
+
+# Streamed steps keep running after the client disconnects, hold on to them until they are done
+_streaming_steps = set()
+
+
+def stream_next_step_response(run: NextStepRun) -> StreamingResponse:
+    """
+    Answers the step as server-sent events: an `action` event for each action as soon as the model has
+    finished writing it, with its index in the actions array as the event id, then a `result` event with
+    the full response once the step is persisted (or an `error` event).
+    """
+    tid = run.tid
+    events = asyncio.Queue()
+
+    async def run_step():
+        parser = IncrementalActionParser()
+        streamed_actions = []
+
+        async def on_text(text: str):
+            for index, action in parser.feed(text):
+                streamed_actions.append(action)
+                await events.put(('action', action, index))
+
+        try:
+            response = await astream_with_thinking(
+                run.chain, {}, lambda line: broadcast_agent_thinking(tid, line), on_text=on_text
+            )
+            # The request's session is closed once the response starts streaming, persist with a session of our own
+            async with AsyncSessionLocal() as session:
+                response_data = await finalize_next_step(run, response, session)
+            await events.put(('result', response_data, None))
+        except Exception as e:
+            print(f"❌ Streaming next step failed for thread {tid}: {e}")
+            if streamed_actions:
+                try:
+                    async with AsyncSessionLocal() as session:
+                        await record_streamed_actions(run, streamed_actions, session)
+                except Exception as record_error:
+                    print(f"❌ Could not record the streamed actions of thread {tid}: {record_error}")
+            await events.put(('error', {'message': str(e)}, None))
+
+    step_task = asyncio.create_task(run_step())
+    _streaming_steps.add(step_task)
+    step_task.add_done_callback(_streaming_steps.discard)
+
+    async def event_stream():
+        while True:
+            event, data, event_id = await events.get()
+            id_line = f"id: {event_id}\n" if event_id is not None else ''
+            yield f"{id_line}event: {event}\ndata: {json.dumps(data)}\n\n"
+            if event != 'action':
+                break
+        await step_task
+
+    return StreamingResponse(event_stream(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        'X-UI-Snapshot-Id': run.ui_snapshot_id,
+    })
+
+
+@router.post('/{tid}/next_step')
+async def next_step(tid: str, next_step_req: NextStepRequest, response: Response,
+                    db: AsyncSession = Depends(get_async_session),
+                    user: User = Depends(get_current_user_dependency)):
+    screenshot = Screenshot.from_b64(next_step_req.screenshot_b64, next_step_req.screenshot_media_type)
+    run = await prepare_next_step(tid, next_step_req, screenshot, db, user)
+    response.headers['X-UI-Snapshot-Id'] = run.ui_snapshot_id
+    return await answer_next_step(run, db)
+
+
+@router.post('/{tid}/next_step/multipart')
+async def next_step_multipart(tid: str, response: Response,
+                              step_request: tuple = Depends(multipart_screenshot_request(NextStepRequest)),
+                              db: AsyncSession = Depends(get_async_session),
+                              user: User = Depends(get_current_user_dependency)):
+    """next_step with the screenshot sent as a binary file part next to the JSON `payload` field."""
+    next_step_req, screenshot = step_request
+    run = await prepare_next_step(tid, next_step_req, screenshot, db, user)
+    response.headers['X-UI-Snapshot-Id'] = run.ui_snapshot_id
+    return await answer_next_step(run, db)
+
+
+@router.post('/{tid}/next_step/stream')
+async def next_step_stream(tid: str, next_step_req: NextStepRequest,
+                           db: AsyncSession = Depends(get_async_session),
+                           user: User = Depends(get_current_user_dependency)):
+    """Same step as next_step, answered as server-sent events (see stream_next_step_response)."""
+    screenshot = Screenshot.from_b64(next_step_req.screenshot_b64, next_step_req.screenshot_media_type)
+    run = await prepare_next_step(tid, next_step_req, screenshot, db, user)
+    return stream_next_step_response(run)
+
+
+@router.post('/{tid}/next_step/stream/multipart')
+async def next_step_stream_multipart(tid: str,
+                                     step_request: tuple = Depends(multipart_screenshot_request(NextStepRequest)),
+                                     db: AsyncSession = Depends(get_async_session),
+                                     user: User = Depends(get_current_user_dependency)):
+    next_step_req, screenshot = step_request
+    run = await prepare_next_step(tid, next_step_req, screenshot, db, user)
+    return stream_next_step_response(run)
@@ -1,8 +1,7 @@
 from fastapi import APIRouter, Depends
 from sqlmodel import select, and_
 from sqlmodel.ext.asyncio.session import AsyncSession
-from db.database import get_async_session
-import os
+from db.database import get_async_session, release_connection
 from typing import Optional
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import SystemMessage, HumanMessage
@@ -10,9 +9,13 @@ import json
 from utils import ai_prompts
 from utils.procedures import CustomError, extract_json, extract_json_array
 from dependencies.auth_dependencies import get_current_user_dependency
+from dependencies.multipart_dependencies import multipart_screenshot_request
 from db.models import (User, Thread, ThreadStatus, ThreadTask)
 from schemas.aiagent import SuggestorRequest
 from utils import llm_provider
+from utils.ui_encoding import encode_interactive_elements
+from utils.ai_helpers import screenshot_message_block, Screenshot
+from utils.llm_usage import set_llm_usage_context
 import datetime
 
 
@@ -26,9 +29,24 @@ router = APIRouter(
 @router.post('')
 async def get_suggestions(request: SuggestorRequest, db: AsyncSession = Depends(get_async_session),
                     user: User = Depends(get_current_user_dependency)):
+    screenshot = Screenshot.from_b64(request.screenshot_b64, request.screenshot_media_type)
+    return await suggest(request, screenshot, db, user)
+
+
+@router.post('/multipart')
+async def get_suggestions_multipart(suggestor_request: tuple = Depends(multipart_screenshot_request(SuggestorRequest)),
+                                    db: AsyncSession = Depends(get_async_session),
+                                    user: User = Depends(get_current_user_dependency)):
+    """Suggestions with the screenshot sent as a binary file part next to the JSON `payload` field."""
+    request, screenshot = suggestor_request
+    return await suggest(request, screenshot, db, user)
+
+
+async def suggest(request: SuggestorRequest, screenshot: Optional[Screenshot], db: AsyncSession, user: User):
+    set_llm_usage_context(user_id=user.id)
     prompt_blocks = [
         {"type": "text", "text": f"Current OS: {request.current_os}"},
-        {"type": "text", "text": f"Current Visible UI Elements: {json.dumps(request.current_interactive_elements)}"},
+        {"type": "text", "text": f"Current Visible UI Elements: {encode_interactive_elements('suggestor', request.current_interactive_elements)}"},
         {"type": "text", "text": f"Current Running Apps: {json.dumps(request.current_running_apps)}"},
         {
             'type': 'text',
@@ -53,29 +71,18 @@ async def get_suggestions(request: SuggestorRequest, db: AsyncSession = Depends(
             "text": f"Most Recent User Tasks (Limited to 20): {json.dumps(most_recent_tasks_arr)}"
         })
 
-    if request.screenshot_b64:
-        if os.getenv('SUGGESTOR_AGENT_MODEL_TYPE') == 'ollama' or os.getenv('SUGGESTOR_AGENT_MODEL_TYPE') == 'gemini':
-            prompt_blocks.append({
-            "type": "image_url",
-            "image_url": f"data:image/png;base64,{request.screenshot_b64}"
-        })
-        else:
-            prompt_blocks.append({
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/png",
-                    "data": request.screenshot_b64
-                }
-            })
-
-    llm = llm_provider.get_llm(agent='suggestor', temperature=1.0)
+    if screenshot is not None:
+        prompt_blocks.append(screenshot_message_block('suggestor', screenshot))
+
+    llm = llm_provider.get_agent_llm('suggestor')
 
     prompt = ChatPromptTemplate.from_messages([
         SystemMessage(content=ai_prompts.SUGGESTOR_AGENT_PROMPT),
         HumanMessage(content=prompt_blocks)
     ])
 
+    await release_connection(db)
+
     chain = prompt | llm
     response = await chain.ainvoke({})
 
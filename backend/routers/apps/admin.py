@@ -0,0 +1,82 @@
+from fastapi import APIRouter, Depends, status
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from dependencies.auth_dependencies import get_admin_user_dependency
+from db.database import get_async_session
+from db.models import User
+from typing import Optional
+from utils.procedures import CustomError
+from db.database import get_pool_stats
+from utils.llm_usage import llm_usage_rollup
+from utils.auth_cache import auth_cache
+from utils.aws_s3 import signed_url_cache
+from utils import llm_provider, prompt_cache
+import datetime
+import os
+
+
+router = APIRouter(
+    prefix='/apps/admin',
+    tags=['apps', 'admin'],
+    dependencies=[Depends(get_admin_user_dependency)]
+)
+
+
+@router.get('/llm_usage')
+async def llm_usage(group_by: str = 'user,day,model', since: Optional[datetime.datetime] = None,
+                    until: Optional[datetime.datetime] = None, user_id: Optional[str] = None,
+                    db: AsyncSession = Depends(get_async_session)):
+    """
+    LLM tokens and latency totals, grouped by a comma separated list of user, day, agent and model.
+    since/until bound the records' creation time, user_id limits the totals to one user.
+    """
+    dimensions = [dimension.strip() for dimension in group_by.split(',') if dimension.strip()]
+    try:
+        return await llm_usage_rollup(db, dimensions, since=since, until=until, user_id=user_id)
+    except ValueError as e:
+        raise CustomError(status.HTTP_400_BAD_REQUEST, str(e))
+
+
+@router.get('/worker_stats')
+async def worker_stats():
+    """
+    Connection pool, caches and LLM clients of the worker that answered (worker_pid), each worker has its own.
+    The DB pool and in-flight LLM calls over all workers are in the Prometheus metrics (/metrics).
+    """
+    return {
+        'worker_pid': os.getpid(),
+        'db_pool': get_pool_stats(),
+        'signed_url_cache': signed_url_cache.stats(),
+        'auth_cache': auth_cache.stats(),
+        'llm_clients': llm_provider.get_llm_stats(),
+        'prompt_cache': prompt_cache.get_usage_stats(),
+    }
+
+
+async def set_user_blocked(uid: str, is_blocked: bool, db: AsyncSession, admin: User):
+    if uid == admin.id:
+        raise CustomError(status.HTTP_400_BAD_REQUEST, 'Cannot_Block_Yourself')
+
+    user = (await db.exec(select(User).where(User.id == uid))).first()
+    if not user:
+        raise CustomError(status.HTTP_404_NOT_FOUND, 'User not found')
+
+    user.is_blocked = is_blocked
+    db.add(user)
+    await db.commit()
+    # Cached sessions of the user would otherwise keep authenticating until they expire
+    await auth_cache.invalidate_user(uid)
+
+    return {'message': 'Success'}
+
+
+@router.post('/users/{uid}/block')
+async def block_user(uid: str, db: AsyncSession = Depends(get_async_session),
+                     admin: User = Depends(get_admin_user_dependency)):
+    return await set_user_blocked(uid, True, db, admin)
+
+
+@router.post('/users/{uid}/unblock')
+async def unblock_user(uid: str, db: AsyncSession = Depends(get_async_session),
+                       admin: User = Depends(get_admin_user_dependency)):
+    return await set_user_blocked(uid, False, db, admin)
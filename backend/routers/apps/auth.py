@@ -6,6 +6,7 @@ from schemas.auth import UserInfo, UserCreate, UserAuth, Logout, RefreshToken, L
 from db.database import get_async_session
 from utils.security import verify_password, hash_password
 from utils.auth_helper import create_login_session, create_token_from_user, decode_token, is_session_valid
+from utils.auth_cache import auth_cache
 import datetime
 from utils import constants
 from utils.procedures import CustomError
@@ -198,7 +199,7 @@ async def logout(logout_obj: Logout, db: AsyncSession = Depends(get_async_sessio
     if payload.get('token_type') != 'access':
         raise CustomError(status.HTTP_400_BAD_REQUEST, 'Invalid_Token')
 
-    if not is_session_valid(payload.get('session_id'), db):
+    if not await is_session_valid(payload.get('session_id'), db):
         raise CustomError(status.HTTP_401_UNAUTHORIZED, 'Invalid_Token')
 
     query = select(LoginSession).where(LoginSession.id == payload.get('session_id'))
@@ -208,6 +209,7 @@ async def logout(logout_obj: Logout, db: AsyncSession = Depends(get_async_sessio
     db.add(login_session)
     await db.commit()
     await db.refresh(login_session)
+    await auth_cache.invalidate_session(login_session.id)
 
     return {
         'message': 'Success'
@@ -221,7 +223,7 @@ async def refresh_current_token(refresh_obj: RefreshToken, db: AsyncSession = De
     if payload.get('token_type') != 'refresh':
         raise CustomError(status.HTTP_400_BAD_REQUEST, 'Invalid_Token')
 
-    if not is_session_valid(payload.get('session_id'), db):
+    if not await is_session_valid(payload.get('session_id'), db):
         raise CustomError(status.HTTP_401_UNAUTHORIZED, 'Invalid_Token')
 
     u_query = select(User).where(User.id == payload.get('user_id'))
@@ -248,6 +250,7 @@ async def refresh_current_token(refresh_obj: RefreshToken, db: AsyncSession = De
     db.add(login_session)
     await db.commit()
     await db.refresh(login_session)
+    await auth_cache.invalidate_session(login_session.id)
 
     return {
         'new_token': new_token,
@@ -1,17 +1,23 @@
-from fastapi import APIRouter, Depends, status
-from sqlmodel import select, and_, update
+from fastapi import APIRouter, Depends, Query, Request, Response, status
+from sqlmodel import select, and_, update, func
 from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import selectinload, defer
+from sqlalchemy.orm.attributes import set_committed_value
 from dependencies.auth_dependencies import get_current_user_dependency
-from db.database import get_async_session
+from db.database import get_async_session, release_connection
 from db.models import (User, Thread, ThreadStatus, ThreadTask, ThreadMessage, ThreadChatType, ThreadChatFromChoices,
                        ThreadTaskStatus, ThreadTaskPlan, ThreadTaskPlanStatus, PlanSubtask, SubtaskStatus)
 from schemas.threads import ListThread, CreateThread, UpdateThread, ListThreadMessage, RetrieveThread, SendMessageObj
-from typing import List
+from typing import List, Optional
 from utils.procedures import CustomError, extract_json
 from utils import ai_helpers
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage
 from utils import ai_prompts, llm_provider
+from utils.agent_context import agent_context_cache
+from utils.llm_usage import set_llm_usage_context
+from utils.pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, keyset_page, split_page
+from utils.http_cache import make_etag, not_modified, not_modified_response
 import json
 import datetime
 
@@ -24,13 +30,35 @@ router = APIRouter(
 
 
 @router.get('', response_model=List[ListThread])
-async def list_threads(db: AsyncSession = Depends(get_async_session), 
+async def list_threads(request: Request, response: Response,
+                       limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                       cursor: Optional[str] = None,
+                       db: AsyncSession = Depends(get_async_session), 
                        user: User = Depends(get_current_user_dependency)):
-    result = await db.exec(select(Thread).where(and_(
+    filters = and_(
         Thread.user_id == user.id,
         Thread.status != ThreadStatus.DELETED
-    )).order_by(Thread.created_at.desc()))
-    return result.all()
+    )
+
+    # Any created, renamed, deleted or status-changed thread changes the count or the latest updated_at
+    result = await db.exec(select(func.count(Thread.id), func.max(Thread.updated_at)).where(filters))
+    etag = make_etag(user.id, *result.one(), limit, cursor)
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers['ETag'] = etag
+
+    query = select(Thread).where(filters)
+
+    # Without a limit every thread is returned, as older clients expect
+    if limit is None:
+        result = await db.exec(query.order_by(Thread.created_at.desc()))
+        return result.all()
+
+    result = await db.exec(keyset_page(query, Thread.created_at, Thread.id, cursor, limit, descending=True))
+    threads, next_cursor = split_page(result.all(), limit)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return threads
 
 
 @router.post('')
@@ -47,7 +75,8 @@ async def create_thread(create_thread_obj: CreateThread,
     if len(working_threads) > 0:
         raise CustomError(status.HTTP_400_BAD_REQUEST, 'Running_Thread')
 
-    llm = llm_provider.get_llm(agent='classifier', temperature=0.1)
+    set_llm_usage_context(user_id=user.id)
+    llm = llm_provider.get_agent_llm('classifier')
 
     result = await db.exec(select(ThreadTask).where(and_(
         ThreadTask.thread.has(Thread.user_id == user.id),
@@ -70,6 +99,7 @@ async def create_thread(create_thread_obj: CreateThread,
 
     chain = prompt | llm
 
+    await release_connection(db)
     response = await chain.ainvoke({})
     response_data = extract_json(response.content)
 
@@ -189,14 +219,32 @@ async def delete_thread(tid: str,
 
 
 @router.get('/{tid}', response_model=RetrieveThread)
-async def retrieve_thread(tid: str, 
+async def retrieve_thread(tid: str, request: Request, response: Response,
                          db: AsyncSession = Depends(get_async_session), 
                          user: User = Depends(get_current_user_dependency)):
-    result = await db.exec(select(Thread).where(and_(
+    filters = and_(
         Thread.id == tid,
         Thread.user_id == user.id,
         Thread.status != ThreadStatus.DELETED
-    )))
+    )
+
+    result = await db.exec(
+        select(Thread.updated_at, func.count(ThreadTask.id), func.max(ThreadTask.updated_at))
+        .outerjoin(ThreadTask, ThreadTask.thread_id == Thread.id)
+        .where(filters)
+        .group_by(Thread.id)
+    )
+    version = result.first()
+
+    if not version:
+        raise CustomError(status.HTTP_404_NOT_FOUND, 'Thread not found')
+
+    etag = make_etag(tid, *version)
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers['ETag'] = etag
+
+    result = await db.exec(select(Thread).where(filters).options(selectinload(Thread.thread_tasks)))
     instance = result.first()
 
     if not instance:
@@ -206,14 +254,48 @@ async def retrieve_thread(tid: str,
 
 
 @router.get('/{tid}/thread_messages', response_model=List[ListThreadMessage])
-async def thread_messages(tid: str, 
+async def thread_messages(tid: str, response: Response,
+                         limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                         cursor: Optional[str] = None,
+                         since: Optional[int] = None,
+                         include_chain_of_thought: Optional[bool] = None,
                          db: AsyncSession = Depends(get_async_session), 
                          user: User = Depends(get_current_user_dependency)):
-    result = await db.exec(select(ThreadMessage).where(and_(
+    # Paginated requests leave the chain of thought out unless asked for, unpaginated ones keep the old response
+    if include_chain_of_thought is None:
+        include_chain_of_thought = limit is None
+
+    # The prompt and screenshot columns are never part of the response
+    options = [selectinload(ThreadMessage.thread_task), defer(ThreadMessage.prompt), defer(ThreadMessage.screenshot)]
+    if not include_chain_of_thought:
+        options.append(defer(ThreadMessage.chain_of_thought))
+
+    query = select(ThreadMessage).where(and_(
         ThreadMessage.thread_id == tid,
         ThreadMessage.thread.has(Thread.user_id == user.id),
-    )).order_by(ThreadMessage.created_at.asc()))
-    return result.all()
+    )).options(*options)
+
+    if since is not None:
+        # Only the messages after the newest one the client has, for refreshing a thread that is already shown.
+        # Ordered by id like the filter, so the last message returned is the one to pass as since next time,
+        # a page is continued with since rather than a cursor.
+        result = await db.exec(query.where(ThreadMessage.id > since).order_by(ThreadMessage.id.asc())
+                               .limit(limit))
+        messages = result.all()
+    elif limit is None:
+        result = await db.exec(query.order_by(ThreadMessage.created_at.asc()))
+        messages = result.all()
+    else:
+        result = await db.exec(keyset_page(query, ThreadMessage.created_at, ThreadMessage.id, cursor, limit))
+        messages, next_cursor = split_page(result.all(), limit)
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    if not include_chain_of_thought:
+        # Fill the deferred column without a lazy load, which an async session can't do
+        for message in messages:
+            set_committed_value(message, 'chain_of_thought', None)
+    return messages
 
 
 @router.post('/cancel_all_running_tasks')
@@ -240,6 +322,7 @@ async def cancel_all_running_tasks(db: AsyncSession = Depends(get_async_session)
                  .values(status=SubtaskStatus.CANCELED))
 
     await db.commit()
+    agent_context_cache.invalidate_user(user.id)
 
     return {'message': 'Success'}
 
@@ -265,6 +348,7 @@ async def cancel_running_task(tid: str,
     db.add(instance)
     await db.commit()
     await db.refresh(instance)
+    agent_context_cache.invalidate(tid)
 
     result = await db.exec(select(ThreadTask).where(and_(
         ThreadTask.thread_id == tid,
@@ -323,7 +407,8 @@ async def send_message(tid: str, obj: SendMessageObj,
     if len(working_threads) > 0:
         raise CustomError(status.HTTP_400_BAD_REQUEST, 'Running_Thread')
 
-    llm = llm_provider.get_llm(agent='classifier', temperature=0.1)
+    set_llm_usage_context(user_id=user.id, thread_id=instance.id)
+    llm = llm_provider.get_agent_llm('classifier')
 
     result = await db.exec(select(ThreadTask).where(and_(
         ThreadTask.thread.has(Thread.user_id == user.id),
@@ -346,6 +431,7 @@ async def send_message(tid: str, obj: SendMessageObj,
 
     chain = prompt | llm
 
+    await release_connection(db)
     response = await chain.ainvoke({})
     response_data = extract_json(response.content)
 
@@ -390,6 +476,7 @@ async def send_message(tid: str, obj: SendMessageObj,
         db.add(instance)
         await db.commit()
         await db.refresh(instance)
+        agent_context_cache.invalidate(tid)
 
         return response_data
     else:
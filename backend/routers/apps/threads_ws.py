@@ -3,13 +3,16 @@ from typing import Optional
 from sqlmodel import select, and_
 from sqlmodel.ext.asyncio.session import AsyncSession
 from db.database import get_async_session
-from db.models import User, Thread, ThreadStatus, ThreadTask, ThreadTaskStatus
+from db.models import Thread, ThreadStatus, ThreadTask, ThreadTaskStatus
 from broadcaster import Broadcast
 from utils.procedures import CustomError
 import json
 import os
 import asyncio
-from utils.auth_helper import decode_token, is_session_valid
+import time
+from utils.auth_helper import decode_token
+from utils.auth_cache import auth_cache
+from utils.metrics import REDIS_PUBLISH_SECONDS, current_step_timings
 
 ws_router = APIRouter(
     prefix='/apps/threads',
@@ -44,7 +47,13 @@ class ThreadChannelManager:
     async def publish_to_thread(self, thread_id: str, message: dict):
         """Publish message to all clients listening to a specific thread"""
         if redis_available and broadcast:
+            started = time.perf_counter()
             await broadcast.publish(channel=f"thread_{thread_id}", message=json.dumps(message))
+            elapsed = time.perf_counter() - started
+            REDIS_PUBLISH_SECONDS.observe(elapsed)
+            timings = current_step_timings()
+            if timings:
+                timings.add('broadcast', elapsed)
 
     async def publish_agent_action(self, thread_id: str, action_description: str, action_data: dict = None):
         """Publish agent action update to thread listeners"""
@@ -145,14 +154,14 @@ async def agent_updates_websocket(
             return
 
         user_id = payload.get('user_id')
-        u_query = select(User).where(User.id == user_id)
-        user = (await db.exec(u_query)).first()
+        cached = await auth_cache.get(db, payload.get('session_id'), user_id)
 
-        if not user:
+        if not cached:
             await websocket.close()
             return
 
-        if not await is_session_valid(payload.get('session_id'), db):
+        user, is_logged_out = cached
+        if is_logged_out or user.is_blocked:
             await websocket.close()
             return
         
@@ -262,13 +271,10 @@ async def broadcast_agent_action(thread_id: str, action: dict):
     await manager.publish_agent_action(thread_id, description, action)
 
 async def broadcast_agent_thinking(thread_id: str, thinking_text: str):
-    """Call this function when the agent is in thinking mode"""
-    # Split thinking into chunks for streaming effect
-    chunks = thinking_text.split('\n')
-    for chunk in chunks:
-        if chunk.strip():
-            await manager.publish_agent_thinking(thread_id, chunk.strip())
-            await asyncio.sleep(0.1)  # Small delay for streaming effect
+    """Call this function when the agent is in thinking mode, each line is published as its own message"""
+    for line in thinking_text.split('\n'):
+        if line.strip():
+            await manager.publish_agent_thinking(thread_id, line.strip())
 
 async def broadcast_task_status_update(thread_id: str, status: str, subtask_info: dict = None):
     """Call this function when task status changes"""
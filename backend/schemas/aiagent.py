@@ -1,16 +1,32 @@
 from pydantic import BaseModel, ConfigDict, Field
-from typing import Optional, List
+from typing import Optional, List, Literal
+
+
+ScreenshotMediaType = Literal['image/png', 'image/jpeg', 'image/webp']
+
+
+class UIStateDelta(BaseModel):
+    base_snapshot_id: str
+    added: dict[str, dict] = {}
+    removed: list[str] = []
+    moved: dict[str, Optional[dict]] = {}
 
 
 class NextStepRequest(BaseModel):
     screenshot_b64: Optional[str] = None
+    screenshot_media_type: ScreenshotMediaType = 'image/png'
     current_interactive_elements: list[dict] = []
     current_os: str
     current_running_apps: list[dict] = []
+    # Sent instead of current_interactive_elements: changes since the snapshot acknowledged in X-UI-Snapshot-Id
+    ui_delta: Optional[UIStateDelta] = None
+    # Sent instead of screenshot_b64 when the screen matches the last screenshot sent for the thread
+    screenshot_unchanged: bool = False
 
 
 class BackgroundNextStepRequest(BaseModel):
     screenshot_b64: Optional[str] = None
+    screenshot_media_type: ScreenshotMediaType = 'image/png'
     current_open_tabs: list[dict] = []
     current_url: str
 
@@ -26,3 +42,4 @@ class SuggestorRequest(BaseModel):
     current_os: str
     current_running_apps: list[dict] = []
     screenshot_b64: Optional[str] = None
+    screenshot_media_type: ScreenshotMediaType = 'image/png'
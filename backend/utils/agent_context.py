@@ -0,0 +1,175 @@
+import datetime
+import json
+import os
+from typing import List, Optional
+from sqlmodel import select, and_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.database import release_connection
+from db.write_behind import message_log_queue
+from db.unit_of_work import StepUnitOfWork
+from db.models import (User, Thread, ThreadStatus, ThreadTask, ThreadTaskStatus, ThreadMessage, ThreadChatType,
+                       ThreadTaskPlan, ThreadTaskPlanStatus, PlanSubtask, SubtaskStatus, ThreadTaskMemoryEntry)
+from utils.ttl_cache import TTLCache
+
+
+ACTION_HISTORY_LIMIT = 5
+MEMORY_TASKS_LIMIT = 5
+
+
+class AgentContext:
+    """
+    The running task of a thread together with its plan, subtasks, recent actions and memory,
+    as needed by the desktop agent endpoints on every step.
+    """
+
+    def __init__(self, user_id: str, thread_updated_at, task: ThreadTask, plan: Optional[ThreadTaskPlan],
+                 subtasks: List[PlanSubtask], action_history: List[dict], memory_items: List[str]):
+        self.user_id = user_id
+        self.thread_updated_at = thread_updated_at
+        self.task = task
+        self.plan = plan
+        self.subtasks = subtasks
+        self.action_history = action_history
+        self.memory_items = memory_items
+
+    @property
+    def current_subtask(self) -> Optional[PlanSubtask]:
+        if not self.plan:
+            return None
+        for subtask in self.subtasks:
+            if subtask.thread_task_plan_id == self.plan.id and subtask.status == SubtaskStatus.ACTIVE:
+                return subtask
+        return None
+
+    @property
+    def previous_subtasks(self) -> List[PlanSubtask]:
+        return [subtask for subtask in self.subtasks if subtask.status != SubtaskStatus.ACTIVE]
+
+    def set_plan(self, plan: ThreadTaskPlan, subtasks: List[PlanSubtask]):
+        self.plan = plan
+        self.subtasks = self.subtasks + subtasks
+        self.subtasks.sort(key=lambda subtask: subtask.ordering)
+
+    def record_action(self, action_data: dict):
+        """Keep the rolling action history (newest first) in sync with a newly written DESKTOP_USE message."""
+        self.action_history.insert(0, action_data)
+        del self.action_history[ACTION_HISTORY_LIMIT:]
+
+    def record_memory(self, text: str):
+        self.memory_items.append(text)
+
+    def bump_version(self, uow: StepUnitOfWork, thread: Thread):
+        """
+        Moves the thread's updated_at forward in the step's commit. Subtask transitions, actions and memory
+        don't touch the Thread row, without this other workers would keep serving their stale cached copy.
+        """
+        updated_at = datetime.datetime.now()
+        uow.transition(thread, updated_at=updated_at)
+        uow.on_commit(lambda: setattr(self, 'thread_updated_at', updated_at))
+
+
+async def load_agent_context(db: AsyncSession, thread: Thread, user: User) -> Optional[AgentContext]:
+    result = await db.exec(select(ThreadTask).where(and_(
+        ThreadTask.thread_id == thread.id,
+        ThreadTask.status == ThreadTaskStatus.WORKING,
+    )))
+    task = result.first()
+
+    if not task:
+        return None
+
+    result = await db.exec(select(ThreadTaskPlan).where(and_(
+        ThreadTaskPlan.thread_task_id == task.id,
+        ThreadTaskPlan.status == ThreadTaskPlanStatus.ACTIVE,
+    )))
+    plan = result.first()
+
+    result = await db.exec(select(PlanSubtask).where(
+        PlanSubtask.plan.has(ThreadTaskPlan.thread_task_id == task.id)
+    ).order_by(PlanSubtask.ordering.asc()))
+    subtasks = list(result.all())
+
+    result = await db.exec(
+        select(ThreadMessage)
+        .where(
+            and_(
+                ThreadMessage.thread_task_id == task.id,
+                ThreadMessage.thread_chat_type == ThreadChatType.DESKTOP_USE,
+            )
+        )
+        .order_by(ThreadMessage.created_at.desc())
+        .limit(ACTION_HISTORY_LIMIT)
+    )
+    action_history = [json.loads(previous_message.text) for previous_message in result.all()]
+
+    if task.needs_memory_from_previous_tasks is True:
+        result = await db.exec(select(ThreadTask).where(and_(
+            ThreadTask.thread.has(Thread.user_id == user.id),
+            ThreadTask.thread.has(Thread.status != ThreadStatus.DELETED),
+        )).order_by(ThreadTask.created_at.desc()).limit(MEMORY_TASKS_LIMIT))
+        tasks_for_memory_ids = [task_for_memory.id for task_for_memory in result.all()]
+
+        result = await db.exec(select(ThreadTaskMemoryEntry).where(
+            ThreadTaskMemoryEntry.thread_task_id.in_(tasks_for_memory_ids)
+        ))
+    else:
+        result = await db.exec(select(ThreadTaskMemoryEntry).where(
+            ThreadTaskMemoryEntry.thread_task_id == task.id
+        ))
+    memory_items = [memory_item.text for memory_item in result.all()]
+
+    # The cached rows outlive this session, detach them so later requests can attach them to their own session.
+    for instance in [task, plan, *subtasks]:
+        if instance is not None:
+            db.expunge(instance)
+
+    return AgentContext(
+        user_id=user.id,
+        thread_updated_at=thread.updated_at,
+        task=task,
+        plan=plan,
+        subtasks=subtasks,
+        action_history=action_history,
+        memory_items=memory_items,
+    )
+
+
+class AgentContextCache:
+    """
+    Per-thread AgentContext cache keyed by thread id.
+    Entries are process-local, so they are also checked against the thread's updated_at, which every step commit
+    moves forward (AgentContext.bump_version) as do stopping and restarting the thread. A step handled by another
+    worker therefore makes this worker reload. Entries also expire after AGENT_CONTEXT_CACHE_TTL seconds.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    async def get(self, db: AsyncSession, thread: Thread, user: User) -> Optional[AgentContext]:
+        context = self._cache.get(thread.id)
+        if context and context.user_id == user.id and context.thread_updated_at == thread.updated_at:
+            return context
+
+        # Rows of this thread still sitting in the write-behind queue would be missing from the history and
+        # memory. Give the connection back to the pool while waiting for them.
+        await release_connection(db)
+        await message_log_queue.flush(thread.id)
+        context = await load_agent_context(db, thread, user)
+        if context:
+            self._cache.set(thread.id, context)
+        return context
+
+    def invalidate(self, thread_id: str):
+        self._cache.pop(thread_id)
+
+    def invalidate_user(self, user_id: str):
+        self._cache.pop_where(lambda thread_id, context: context.user_id == user_id)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+agent_context_cache = AgentContextCache(
+    ttl=float(os.getenv('AGENT_CONTEXT_CACHE_TTL', '300')),
+    max_size=int(os.getenv('AGENT_CONTEXT_CACHE_MAX_SIZE', '1000')),
+)
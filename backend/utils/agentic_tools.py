@@ -1,16 +1,20 @@
-from langchain_community.document_loaders import UnstructuredPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import WebBaseLoader
 from langchain_core.prompts import ChatPromptTemplate
-from youtube_transcript_api import YouTubeTranscriptApi
 from . import llm_provider
 import asyncio
 
 
-llm = llm_provider.get_llm(agent='summarizer', temperature=1.0)
+# Document loaders, the text splitter and the transcript API are imported inside the tools that use them,
+# they are slow to import and only needed once an agent actually calls a tool.
+
+
+def get_summarizer_llm():
+    return llm_provider.get_agent_llm('summarizer')
 
 
 def fetch_and_summarize_url(url: str) -> str:
+    from langchain_community.document_loaders import WebBaseLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     loader = WebBaseLoader(url)
     documents = loader.load()
 
@@ -20,13 +24,16 @@ def fetch_and_summarize_url(url: str) -> str:
     full_text = "\n\n".join(doc.page_content for doc in docs)
 
     prompt = ChatPromptTemplate.from_template("Summarize the following:\n\n{input}")
-    chain = prompt | llm
+    chain = prompt | get_summarizer_llm()
 
     result = chain.invoke({"input": full_text})
     return result.content if hasattr(result, "content") else str(result)
 
 
 def fetch_and_summarize_pdf(file_path: str = None, url: str = None) -> str:
+    from langchain_community.document_loaders import UnstructuredPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     if url:
         import requests
         import tempfile
@@ -46,13 +53,16 @@ def fetch_and_summarize_pdf(file_path: str = None, url: str = None) -> str:
     full_text = "\n\n".join(doc.page_content for doc in docs)
 
     prompt = ChatPromptTemplate.from_template("Summarize the following:\n\n{input}")
-    chain = prompt | llm
+    chain = prompt | get_summarizer_llm()
 
     result = chain.invoke({"input": full_text})
     return result.content if hasattr(result, "content") else str(result)
 
 
 def summarize_youtube_video(url: str) -> str:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from youtube_transcript_api import YouTubeTranscriptApi
+
     try:
         # Extract video ID from URL
         if "watch?v=" in url:
@@ -83,7 +93,7 @@ def summarize_youtube_video(url: str) -> str:
 
         # Use the LLM to summarize
         prompt = ChatPromptTemplate.from_template("Summarize the following YouTube transcript:\n\n{input}")
-        chain = prompt | llm
+        chain = prompt | get_summarizer_llm()
         result = chain.invoke({"input": full_text})
 
         return result.content if hasattr(result, "content") else str(result)
@@ -1,11 +1,14 @@
 from langchain_core.prompts import ChatPromptTemplate
 from utils import ai_prompts
+import base64
 import json
+import os
+from typing import Awaitable, Callable, Optional
 from utils import llm_provider
 
 
 async def generate_thread_title(task):
-    llm = llm_provider.get_llm(agent='title', temperature=1.0)
+    llm = llm_provider.get_agent_llm('title')
 
     prompt = ChatPromptTemplate.from_messages([
         ('system', ai_prompts.TITLE_GENERATION_PROMPT),
@@ -25,3 +28,111 @@ async def generate_thread_title(task):
             response_data = {'title': ''}
 
     return response_data.get('title')
+
+
+def thinking_text_from_block(block) -> Optional[str]:
+    """Text of an extended thinking content block (Anthropic 'thinking' or Bedrock 'reasoning_content'), else None."""
+    if not isinstance(block, dict):
+        return None
+    if block.get('type') == 'thinking':
+        return block.get('thinking', '')
+    if block.get('type') == 'reasoning_content':
+        return block.get('reasoning_content', {}).get('text', '')
+    return None
+
+
+async def astream_with_thinking(chain, inputs: dict, on_thinking_line: Callable[[str], Awaitable],
+                                on_text: Optional[Callable[[str], Awaitable]] = None):
+    """
+    Streams the chain's response and awaits on_thinking_line for every line of extended thinking as soon as it is
+    complete, instead of replaying the thinking once the whole response is in. on_text, if given, receives each
+    piece of the response text as it arrives.
+    Returns the response message assembled from the streamed chunks.
+    """
+    response = None
+    pending = ''
+    async for chunk in chain.astream(inputs):
+        response = chunk if response is None else response + chunk
+        if isinstance(chunk.content, str):
+            if on_text and chunk.content:
+                await on_text(chunk.content)
+            continue
+        for block in chunk.content:
+            if on_text and isinstance(block, dict) and block.get('type') == 'text' and block.get('text'):
+                await on_text(block['text'])
+                continue
+            thinking_text = thinking_text_from_block(block)
+            if not thinking_text:
+                continue
+            *lines, pending = (pending + thinking_text).split('\n')
+            for line in lines:
+                if line.strip():
+                    await on_thinking_line(line.strip())
+
+    if pending.strip():
+        await on_thinking_line(pending.strip())
+    return response
+
+
+SCREENSHOT_EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/webp': 'webp',
+}
+
+
+class Screenshot:
+    """
+    A screenshot as it reached the API, raw bytes (multipart upload) or base64 (JSON body).
+    The other form is only computed when something needs it, and only once.
+    """
+
+    def __init__(self, media_type: str = 'image/png', data: Optional[bytes] = None, b64: Optional[str] = None):
+        self.media_type = media_type
+        self._data = data
+        self._b64 = b64
+
+    @classmethod
+    def from_b64(cls, screenshot_b64: Optional[str], media_type: str = 'image/png') -> Optional['Screenshot']:
+        return cls(media_type, b64=screenshot_b64) if screenshot_b64 else None
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = base64.b64decode(self._b64)
+        return self._data
+
+    @property
+    def b64(self) -> str:
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self._data).decode('ascii')
+        return self._b64
+
+    @property
+    def size(self) -> int:
+        """Size of the image in bytes, without decoding the base64 form."""
+        if self._data is not None:
+            return len(self._data)
+        return len(self._b64) * 3 // 4 - self._b64.count('=', -2)
+
+    @property
+    def extension(self) -> str:
+        return SCREENSHOT_EXTENSIONS[self.media_type]
+
+
+def screenshot_message_block(agent: str, screenshot: Screenshot) -> dict:
+    """Screenshot content block in the format the agent's provider expects, the only place base64 is needed."""
+    model_type = os.getenv(f"{agent.upper()}_AGENT_MODEL_TYPE")
+    if model_type == 'ollama' or model_type == 'gemini':
+        return {
+            "type": "image_url",
+            "image_url": f"data:{screenshot.media_type};base64,{screenshot.b64}"
+        }
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": screenshot.media_type,
+            "data": screenshot.b64
+        }
+    }
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+from typing import Optional
+from sqlmodel import select, and_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.models import User, LoginSession
+from db.write_behind import running_multiple_workers
+from utils.ttl_cache import TTLCache
+
+
+# Left out of cache entries, no authenticated route reads them from the dependency's user
+_SECRET_FIELDS = ('password', 'google_token')
+
+# Broadcaster channel on which invalidations reach the in-process entries of every worker
+INVALIDATION_CHANNEL = 'auth_cache_invalidation'
+
+
+def _dump_user(user: User) -> dict:
+    return user.model_dump(mode='json', exclude=set(_SECRET_FIELDS))
+
+
+def _load_user(data: dict) -> User:
+    return User.model_validate({**dict.fromkeys(User.model_fields), **data})
+
+
+class AuthCache:
+    """
+    A login session's user and logged out flag keyed by session id, so authenticating a request doesn't
+    query users and login_sessions every time. Entries are dropped on logout, token refresh and when the user
+    is blocked: in every worker through the Redis broadcaster, and in the optional Redis tier
+    (AUTH_CACHE_REDIS=true) shared by all workers. Several workers without a broadcaster couldn't drop each
+    other's entries, the in-process tier is then disabled.
+    """
+
+    def __init__(self, ttl: float, max_size: int, redis_ttl: int):
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+        self.redis_ttl = redis_ttl
+        self._redis = None
+        self._broadcast = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def connect_broadcast(self, broadcast) -> bool:
+        """Publish invalidations on broadcast and apply the ones of the other workers, False if it can't subscribe."""
+        self._broadcast = broadcast
+        ready = asyncio.Event()
+        self._listener = asyncio.create_task(self._listen(ready))
+        await ready.wait()
+        if self._listener.done():
+            print(f"⚠️ Auth cache invalidation broadcast disabled: {self._listener.exception()}")
+            self._broadcast = None
+            self._listener = None
+            return False
+        return True
+
+    def disable_local(self):
+        self._cache = TTLCache(max_size=self._cache.max_size, ttl=0)
+        print("⚠️ Auth cache kept out of the workers, invalidations can't reach them without Redis")
+
+    async def _listen(self, ready: asyncio.Event):
+        try:
+            async with self._broadcast.subscribe(channel=INVALIDATION_CHANNEL) as subscriber:
+                ready.set()
+                async for event in subscriber:
+                    message = json.loads(event.message)
+                    if 'session_id' in message:
+                        self._cache.pop(message['session_id'])
+                    if 'user_id' in message:
+                        self._cache.pop_where(lambda session_id, entry: entry['user']['id'] == message['user_id'])
+        finally:
+            ready.set()
+
+    async def connect_redis(self, redis_url: str):
+        try:
+            from redis import asyncio as aioredis
+
+            self._redis = aioredis.from_url(redis_url)
+            await self._redis.ping()
+            print("✅ Auth cache using Redis")
+        except Exception as e:
+            print(f"⚠️ Auth cache Redis tier disabled: {e}")
+            self._redis = None
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._redis:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def get(self, db: AsyncSession, session_id: int, user_id: str) -> Optional[tuple[User, bool]]:
+        """(user, is_logged_out) of a login session of user_id, None when there is no such session."""
+        entry = self._cache.get(session_id)
+        if entry is None and self._redis:
+            entry = await self._redis_get(session_id)
+            if entry is not None:
+                self._cache.set(session_id, entry)
+
+        if entry is None:
+            result = await db.exec(
+                select(User, LoginSession.is_logged_out)
+                .join(LoginSession, LoginSession.user_id == User.id)
+                .where(and_(LoginSession.id == session_id, User.id == user_id))
+            )
+            row = result.first()
+            if not row:
+                return None
+            user, is_logged_out = row
+            entry = {'user': _dump_user(user), 'is_logged_out': is_logged_out}
+            self._cache.set(session_id, entry)
+            await self._redis_set(session_id, entry)
+
+        if entry['user']['id'] != user_id:
+            return None
+        return _load_user(entry['user']), entry['is_logged_out']
+
+    async def invalidate_session(self, session_id: int):
+        self._cache.pop(session_id)
+        await self._publish({'session_id': session_id})
+        if self._redis:
+            try:
+                await self._redis.delete(f'auth:session:{session_id}')
+            except Exception as e:
+                print(f"⚠️ Auth cache Redis delete failed: {e}")
+
+    async def invalidate_user(self, user_id: str):
+        self._cache.pop_where(lambda session_id, entry: entry['user']['id'] == user_id)
+        await self._publish({'user_id': user_id})
+        if self._redis:
+            try:
+                session_ids = await self._redis.smembers(f'auth:user:{user_id}')
+                await self._redis.delete(f'auth:user:{user_id}',
+                                         *[f"auth:session:{session_id.decode()}" for session_id in session_ids])
+            except Exception as e:
+                print(f"⚠️ Auth cache Redis delete failed: {e}")
+
+    async def _publish(self, message: dict):
+        if not self._broadcast:
+            return
+        try:
+            await self._broadcast.publish(channel=INVALIDATION_CHANNEL, message=json.dumps(message))
+        except Exception as e:
+            print(f"⚠️ Auth cache invalidation broadcast failed: {e}")
+
+    async def _redis_get(self, session_id: int) -> Optional[dict]:
+        try:
+            raw = await self._redis.get(f'auth:session:{session_id}')
+            return json.loads(raw) if raw else None
+        except Exception as e:
+            print(f"⚠️ Auth cache Redis read failed: {e}")
+            return None
+
+    async def _redis_set(self, session_id: int, entry: dict):
+        if not self._redis:
+            return
+        user_key = f"auth:user:{entry['user']['id']}"
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.set(f'auth:session:{session_id}', json.dumps(entry), ex=self.redis_ttl)
+                pipe.sadd(user_key, session_id)
+                pipe.expire(user_key, self.redis_ttl)
+                await pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Auth cache Redis write failed: {e}")
+
+    def stats(self) -> dict:
+        return {**self._cache.stats(), 'redis': self._redis is not None, 'broadcast': self._broadcast is not None}
+
+
+auth_cache = AuthCache(
+    ttl=float(os.getenv('AUTH_CACHE_TTL', '30')),
+    max_size=int(os.getenv('AUTH_CACHE_MAX_SIZE', '10000')),
+    redis_ttl=int(os.getenv('AUTH_CACHE_REDIS_TTL', '300')),
+)
+
+
+async def init_auth_cache():
+    # After init_redis(), imported here as threads_ws authenticates through this module
+    from routers.apps import threads_ws
+
+    connected = threads_ws.redis_available and threads_ws.broadcast \
+        and await auth_cache.connect_broadcast(threads_ws.broadcast)
+    if not connected and running_multiple_workers():
+        auth_cache.disable_local()
+
+    redis_connection = os.getenv('REDIS_CONNECTION')
+    if os.getenv('AUTH_CACHE_REDIS', 'false') == 'true' and redis_connection:
+        await auth_cache.connect_redis(redis_connection)
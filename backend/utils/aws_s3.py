@@ -1,26 +1,138 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
+import shutil
+import threading
+from .ttl_cache import TTLCache
+
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 's3')  # s3 | local
+STORAGE_MAX_POOL_CONNECTIONS = int(os.getenv('STORAGE_MAX_POOL_CONNECTIONS', '32'))
+# Share of a signed URL's lifetime it is reused for, so a cached URL always has plenty of validity left
+SIGNED_URL_CACHE_TTL_RATIO = float(os.getenv('SIGNED_URL_CACHE_TTL_RATIO', '0.5'))
+
+# Objects above the threshold are sent as concurrent multipart uploads
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=4,
+)
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+_storage = None
+_storage_executor = None
+
+# Signed URLs keyed by (object key, expiration), ttl is set per entry from the expiration
+signed_url_cache = TTLCache(max_size=int(os.getenv('SIGNED_URL_CACHE_MAX_SIZE', '10000')))
 
 
 def get_s3_client():
-    try:
-        # Initialize the S3 client
-        s3_client = boto3.client('s3', region_name='us-east-1')  # Specify region if needed
-        return s3_client
-    except (NoCredentialsError, PartialCredentialsError) as e:
-        raise RuntimeError("AWS credentials not found or incomplete") from e
+    """
+    Process-wide S3 client. boto3 clients are thread-safe, so one client (and its connection pool) is shared
+    by every request instead of paying client construction and new TLS connections on each upload.
+    AWS_S3_ENDPOINT_URL points it at an S3-compatible stand-in such as MinIO.
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                try:
+                    _s3_client = boto3.client(
+                        's3',
+                        region_name=os.getenv('AWS_DEFAULT_REGION', 'us-east-1'),
+                        endpoint_url=os.getenv('AWS_S3_ENDPOINT_URL') or None,
+                        config=Config(
+                            max_pool_connections=STORAGE_MAX_POOL_CONNECTIONS,
+                            tcp_keepalive=True,
+                            retries={'max_attempts': 3, 'mode': 'standard'},
+                        ),
+                    )
+                except (NoCredentialsError, PartialCredentialsError) as e:
+                    raise RuntimeError("AWS credentials not found or incomplete") from e
+    return _s3_client
 
 
-def generate_signed_url(object_name: str, expiration: int = 3600):
+class S3StorageBackend:
+    def __init__(self, bucket: str):
+        self.bucket = bucket
 
-    s3_client = get_s3_client()
-    try:
-        response = s3_client.generate_presigned_url(
+    def upload_fileobj(self, fileobj, key: str):
+        get_s3_client().upload_fileobj(fileobj, self.bucket, key, Config=TRANSFER_CONFIG)
+
+    def generate_signed_url(self, key: str, expiration: int) -> str:
+        return get_s3_client().generate_presigned_url(
             'get_object',
-            Params={'Bucket': os.getenv('AWS_BUCKET'), 'Key': object_name},
+            Params={'Bucket': self.bucket, 'Key': key},
             ExpiresIn=expiration,
         )
-        return response
+
+
+class LocalStorageBackend:
+    """Stores objects under a local directory, for tests and benchmarks that shouldn't touch object storage."""
+
+    def __init__(self, root: str, base_url: str = None):
+        self.root = root
+        self.base_url = base_url
+
+    def upload_fileobj(self, fileobj, key: str):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(fileobj, f)
+
+    def generate_signed_url(self, key: str, expiration: int) -> str:
+        if self.base_url:
+            return f"{self.base_url.rstrip('/')}/{key}"
+        return 'file://' + os.path.abspath(os.path.join(self.root, key))
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == 'local':
+            _storage = LocalStorageBackend(
+                os.getenv('STORAGE_LOCAL_DIR', 'local_storage'),
+                os.getenv('STORAGE_LOCAL_BASE_URL'),
+            )
+        elif STORAGE_BACKEND == 's3':
+            _storage = S3StorageBackend(os.getenv('AWS_BUCKET'))
+        else:
+            raise ValueError(f"Unsupported storage backend '{STORAGE_BACKEND}'")
+    return _storage
+
+
+def upload_fileobj(fileobj, key: str):
+    get_storage().upload_fileobj(fileobj, key)
+
+
+async def upload_fileobj_async(fileobj, key: str):
+    """
+    Runs the upload on a thread pool sized to the client's connection pool, so storage I/O neither blocks the
+    event loop nor competes with other work on the default executor.
+    """
+    global _storage_executor
+    if _storage_executor is None:
+        _storage_executor = ThreadPoolExecutor(max_workers=STORAGE_MAX_POOL_CONNECTIONS,
+                                               thread_name_prefix='storage')
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_storage_executor, upload_fileobj, fileobj, key)
+
+
+def generate_signed_url(object_name: str, expiration: int = 3600):
+    cache_key = (object_name, expiration)
+    url = signed_url_cache.get(cache_key)
+    if url is not None:
+        return url
+
+    try:
+        url = get_storage().generate_signed_url(object_name, expiration)
     except Exception as e:
         raise RuntimeError(f'Failed to generate signed URL: {e}')
+
+    signed_url_cache.set(cache_key, url, ttl=expiration * SIGNED_URL_CACHE_TTL_RATIO)
+    return url
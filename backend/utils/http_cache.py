@@ -0,0 +1,23 @@
+import hashlib
+import json
+from fastapi import Request, Response, status
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag over whatever identifies a version of the resource (ids, updated_at, counts, query params)."""
+    digest = hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match already names etag (weak comparison)."""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return etag.removeprefix('W/') in [tag.strip().removeprefix('W/') for tag in header.split(',')]
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
@@ -1,19 +1,94 @@
 import os
+import threading
+import time
 from dotenv import load_dotenv
-from botocore.config import Config
-
-from langchain_openai import ChatOpenAI, AzureChatOpenAI
-from langchain_aws import ChatBedrockConverse
-from langchain_anthropic import ChatAnthropic
-from langchain_ollama import ChatOllama
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.callbacks import BaseCallbackHandler
+from utils.llm_usage import LLMUsageRecorder
+from utils.metrics import LLM_IN_FLIGHT_CALLS
 
 load_dotenv()  # Load env variables from .env
 
+
+class LLMClientStats(BaseCallbackHandler):
+    """Callback handler attached to a cached client, tracks its in-flight calls and latency."""
+
+    run_inline = True  # cheap bookkeeping, no need to hop to an executor thread for async calls
+
+    def __init__(self, model_type: str, agent: str):
+        self.in_flight = 0
+        self._in_flight_gauge = LLM_IN_FLIGHT_CALLS.labels(model_type, agent)
+        self.calls = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        with self._lock:
+            self.in_flight += 1
+            self._started[run_id] = time.perf_counter()
+        self._in_flight_gauge.inc()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.on_chat_model_start(serialized, prompts, run_id=run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, failed=True)
+
+    def _finish(self, run_id, failed: bool = False):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+            if started is None:
+                return
+            latency = time.perf_counter() - started
+            self.in_flight -= 1
+            self.calls += 1
+            self.errors += int(failed)
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        self._in_flight_gauge.dec()
+
+    def snapshot(self) -> dict:
+        return {
+            'in_flight': self.in_flight,
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_latency': self.total_latency / self.calls if self.calls else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+
+# The settings each agent's clients are requested with, one entry per variant. Call sites go through
+# get_agent_llm() so prewarm_llms() warms exactly the clients (registry keys) that requests use.
+AGENT_LLM_SETTINGS = {
+    'classifier': {'default': {'temperature': 0.1}},
+    'planner': {'default': {'temperature': 0.3}},
+    'computer_use': {
+        'default': {'temperature': 0.0},
+        'thinking': {'temperature': 1.0, 'thinking_enabled': True},
+    },
+    'suggestor': {'default': {'temperature': 1.0}},
+    'title': {'default': {'temperature': 1.0}},
+    'summarizer': {'default': {'temperature': 1.0}},
+}
+
+
+# One client per (agent, model_type, model_id, temperature, max_tokens, thinking_enabled). Clients are reused
+# across requests so their HTTP connection pools (and TLS sessions) stay warm.
+_llm_registry = {}
+_llm_stats = {}
+_llm_registry_lock = threading.Lock()
+
+
 def get_llm(agent: str, temperature: float = 0.0, max_tokens: int = None, thinking_enabled: bool = False) -> BaseChatModel:
     """
     Get an LLM instance based on agent name and environment variables.
+    Instances are cached, callers must not mutate them (bind/with_structured_output return new runnables).
 
     Args:
         agent (str): Logical name of the agent, e.g., "planner", "suggestor", "computer_use", "classifier", "title"
@@ -29,32 +104,99 @@ def get_llm(agent: str, temperature: float = 0.0, max_tokens: int = None, thinki
     if not model_type or not model_id:
         raise ValueError(f"Missing model config for agent: {agent}")
 
+    key = (agent, model_type, model_id, temperature, max_tokens, thinking_enabled)
+    llm = _llm_registry.get(key)
+    if llm is not None:
+        return llm
+
+    with _llm_registry_lock:
+        llm = _llm_registry.get(key)
+        if llm is None:
+            stats = LLMClientStats(model_type, agent)
+            usage_recorder = LLMUsageRecorder(agent, model_type, model_id)
+            llm = _build_llm(agent, model_type, model_id, temperature, max_tokens, thinking_enabled,
+                             [stats, usage_recorder])
+            _llm_stats[key] = stats
+            _llm_registry[key] = llm
+    return llm
+
+
+def get_agent_llm(agent: str, variant: str = 'default') -> BaseChatModel:
+    """The cached client of an agent with its settings from AGENT_LLM_SETTINGS."""
+    return get_llm(agent, **AGENT_LLM_SETTINGS[agent][variant])
+
+
+def get_llm_stats() -> list:
+    return [
+        {
+            'agent': agent,
+            'model_type': model_type,
+            'model_id': model_id,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'thinking_enabled': thinking_enabled,
+            **stats.snapshot(),
+        }
+        for (agent, model_type, model_id, temperature, max_tokens, thinking_enabled), stats in _llm_stats.items()
+    ]
+
+
+async def prewarm_llms():
+    """
+    Open connections to the providers of the agents in LLM_PREWARM_AGENTS (comma separated) ahead of the first
+    request, by listing models through each client's underlying SDK. Failures are only logged.
+    """
+    agents = [agent.strip() for agent in os.getenv('LLM_PREWARM_AGENTS', '').split(',') if agent.strip()]
+    for agent in agents:
+        # Every variant is a separate client with its own connection pool
+        for variant, settings in AGENT_LLM_SETTINGS.get(agent, {'default': {}}).items():
+            try:
+                llm = get_llm(agent, **settings)
+                sdk_client = getattr(llm, 'root_async_client', None) or getattr(llm, '_async_client', None)
+                if sdk_client is None:
+                    print(f"ℹ️ No connection to prewarm for agent '{agent}' ({variant})")
+                    continue
+                await sdk_client.models.list()
+                print(f"✅ Prewarmed LLM connection for agent '{agent}' ({variant})")
+            except Exception as e:
+                print(f"⚠️ Failed to prewarm LLM for agent '{agent}' ({variant}): {e}")
+
+
+def _build_llm(agent: str, model_type: str, model_id: str, temperature: float, max_tokens: int,
+               thinking_enabled: bool, callbacks: list) -> BaseChatModel:
+    # Provider packages are heavy and a deployment only uses one or two of them, so they are imported on first use
     if model_type == "azure_openai":
+        from langchain_openai import AzureChatOpenAI
         return AzureChatOpenAI(
             azure_deployment=model_id,
             api_version=os.getenv("OPENAI_API_VERSION", "2024-12-01-preview"),
             temperature=temperature,
             max_tokens=max_tokens,
             timeout=None,
-            max_retries=2
+            max_retries=2,
+            callbacks=callbacks,
         )
     
     elif model_type == "openai":
+        from langchain_openai import ChatOpenAI
         return ChatOpenAI(
             model=model_id,
             temperature=temperature,
             max_tokens=max_tokens,
             timeout=None,
-            max_retries=2
+            max_retries=2,
+            callbacks=callbacks,
         )
 
     elif model_type == "anthropic":
+        from langchain_anthropic import ChatAnthropic
         if not thinking_enabled:
             return ChatAnthropic(
                 model=model_id,
                 temperature=temperature,
                 timeout=None,
                 max_retries=2,
+                callbacks=callbacks,
             )
         else:
             return ChatAnthropic(
@@ -63,23 +205,30 @@ def get_llm(agent: str, temperature: float = 0.0, max_tokens: int = None, thinki
                 timeout=None,
                 max_retries=2,
                 thinking={"type": "enabled", "budget_tokens": 1024},
+                callbacks=callbacks,
             )
     
     elif model_type == "ollama":
+        from langchain_ollama import ChatOllama
         return ChatOllama(
             base_url=os.getenv('OLLAMA_URL'),
             model=model_id,
-            temperature=temperature
+            temperature=temperature,
+            callbacks=callbacks,
         )
     
     elif model_type == "gemini":
+        from langchain_google_genai import ChatGoogleGenerativeAI
         return ChatGoogleGenerativeAI(
             model=model_id,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            callbacks=callbacks,
         )
 
     elif model_type == "bedrock":
+        from botocore.config import Config
+        from langchain_aws import ChatBedrockConverse
         thinking_params = {
             "thinking": {
                 "type": "enabled",
@@ -99,7 +248,8 @@ def get_llm(agent: str, temperature: float = 0.0, max_tokens: int = None, thinki
                 max_tokens=max_tokens,
                 config=boto3_config,
                 region_name=os.getenv("BEDROCK_REGION", "us-east-1"),
-                additional_model_request_fields=thinking_params
+                additional_model_request_fields=thinking_params,
+                callbacks=callbacks,
             )
         else:
             return ChatBedrockConverse(
@@ -107,7 +257,8 @@ def get_llm(agent: str, temperature: float = 0.0, max_tokens: int = None, thinki
                 temperature=temperature,
                 max_tokens=max_tokens,
                 config=boto3_config,
-                region_name=os.getenv("BEDROCK_REGION", "us-east-1")
+                region_name=os.getenv("BEDROCK_REGION", "us-east-1"),
+                callbacks=callbacks,
             )
 
     else:
@@ -0,0 +1,147 @@
+import datetime
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from sqlalchemy import cast, Integer
+from sqlmodel import select, func, and_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.models import LLMUsageRecord
+from db.write_behind import llm_usage_queue
+
+
+# Who an LLM call is made for: user_id, thread_id, thread_task_id, plan_subtask_id and agent_aliases
+# (e.g. {'computer_use': 'background'} to tell background mode steps apart). Set by the request handlers,
+# copied into tasks and worker threads started from them.
+_usage_context: ContextVar[Optional[dict]] = ContextVar('llm_usage_context', default=None)
+
+
+def set_llm_usage_context(**fields):
+    """Adds fields to the usage context of the current request."""
+    _usage_context.set({**(_usage_context.get() or {}), **fields})
+
+
+def _has_image(messages) -> bool:
+    for message_list in messages:
+        for message in message_list:
+            content = getattr(message, 'content', None)
+            if isinstance(content, list) and any(
+                isinstance(block, dict) and block.get('type') in ('image', 'image_url') for block in content
+            ):
+                return True
+    return False
+
+
+def _usage_metadata(response) -> dict:
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+            if usage:
+                return usage
+    return {}
+
+
+class LLMUsageRecorder(BaseCallbackHandler):
+    """Callback handler attached to a cached client, writes an LLMUsageRecord per call through llm_usage_queue."""
+
+    run_inline = True
+
+    def __init__(self, agent: str, model_type: str, model_id: str):
+        self.agent = agent
+        self.model_type = model_type
+        self.model_id = model_id
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        with self._lock:
+            self._started[run_id] = (time.perf_counter(), _has_image(messages), _usage_context.get() or {})
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        with self._lock:
+            self._started[run_id] = (time.perf_counter(), False, _usage_context.get() or {})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._record(run_id, _usage_metadata(response))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._record(run_id, {}, failed=True)
+
+    def _record(self, run_id, usage: dict, failed: bool = False):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is None or not llm_usage_queue.running:
+            return
+        started_at, has_screenshot, context = started
+        details = usage.get('input_token_details') or {}
+        llm_usage_queue.offer(LLMUsageRecord(
+            user_id=context.get('user_id'),
+            thread_id=context.get('thread_id'),
+            thread_task_id=context.get('thread_task_id'),
+            plan_subtask_id=context.get('plan_subtask_id'),
+            agent=(context.get('agent_aliases') or {}).get(self.agent, self.agent),
+            model_type=self.model_type,
+            model_id=self.model_id,
+            input_tokens=usage.get('input_tokens') or 0,
+            output_tokens=usage.get('output_tokens') or 0,
+            cache_read_tokens=details.get('cache_read') or 0,
+            cache_creation_tokens=details.get('cache_creation') or 0,
+            latency_ms=round((time.perf_counter() - started_at) * 1000),
+            has_screenshot=has_screenshot,
+            failed=failed,
+        ))
+
+
+# Rollup dimension -> (column, name in the result rows)
+ROLLUP_DIMENSIONS = {
+    'user': (LLMUsageRecord.user_id, 'user_id'),
+    'day': (func.date(LLMUsageRecord.created_at), 'day'),
+    'agent': (LLMUsageRecord.agent, 'agent'),
+    'model': (LLMUsageRecord.model_id, 'model_id'),
+}
+
+
+async def llm_usage_rollup(db: AsyncSession, group_by: list, since: Optional[datetime.datetime] = None,
+                           until: Optional[datetime.datetime] = None, user_id: Optional[str] = None) -> list:
+    """Token and latency totals of the usage records grouped by any of ROLLUP_DIMENSIONS."""
+    for dimension in group_by:
+        if dimension not in ROLLUP_DIMENSIONS:
+            raise ValueError(f"Unknown usage rollup dimension '{dimension}'")
+
+    filters = []
+    if since:
+        filters.append(LLMUsageRecord.created_at >= since)
+    if until:
+        filters.append(LLMUsageRecord.created_at < until)
+    if user_id:
+        filters.append(LLMUsageRecord.user_id == user_id)
+
+    dimensions = [column.label(name) for column, name in (ROLLUP_DIMENSIONS[dimension] for dimension in group_by)]
+    query = select(
+        *dimensions,
+        func.count(LLMUsageRecord.id).label('calls'),
+        func.sum(cast(LLMUsageRecord.failed, Integer)).label('failed_calls'),
+        func.sum(cast(LLMUsageRecord.has_screenshot, Integer)).label('screenshot_calls'),
+        func.sum(LLMUsageRecord.input_tokens).label('input_tokens'),
+        func.sum(LLMUsageRecord.output_tokens).label('output_tokens'),
+        func.sum(LLMUsageRecord.cache_read_tokens).label('cache_read_tokens'),
+        func.sum(LLMUsageRecord.cache_creation_tokens).label('cache_creation_tokens'),
+        func.sum(LLMUsageRecord.latency_ms).label('total_latency_ms'),
+        func.avg(LLMUsageRecord.latency_ms).label('avg_latency_ms'),
+        func.max(LLMUsageRecord.latency_ms).label('max_latency_ms'),
+    )
+    if filters:
+        query = query.where(and_(*filters))
+    if dimensions:
+        query = query.group_by(*dimensions).order_by(*dimensions)
+
+    result = await db.exec(query)
+    rows = []
+    for row in result.all():
+        row = dict(row._mapping)
+        if isinstance(row.get('day'), (datetime.date, datetime.datetime)):
+            row['day'] = row['day'].isoformat()
+        row['avg_latency_ms'] = float(row['avg_latency_ms'] or 0)
+        rows.append(row)
+    return rows
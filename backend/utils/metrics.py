@@ -0,0 +1,162 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Optional
+from fastapi import Request
+from prometheus_client import CollectorRegistry, Gauge, Histogram, generate_latest, multiprocess
+
+
+# With several uvicorn workers every process writes its samples to files in this directory (it must exist and
+# be emptied before the workers start, see the Dockerfile) and /metrics merges them, whichever worker serves it.
+# Read by prometheus_client when it is imported, so it has to be set in the environment, not only in .env.
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+RESOURCE_METRICS_INTERVAL = float(os.getenv('RESOURCE_METRICS_INTERVAL', '5'))
+
+
+# Agent steps take seconds, LLM calls up to a minute or two
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+REQUEST_SECONDS = Histogram(
+    'neuralagent_http_request_duration_seconds',
+    'Time to respond to an HTTP request (until the response starts for streamed responses).',
+    ['method', 'route', 'status'],
+    buckets=LATENCY_BUCKETS,
+)
+
+STEP_STAGE_SECONDS = Histogram(
+    'neuralagent_step_stage_duration_seconds',
+    'Time an agent step spent in each stage (db_load, screenshot_upload, prompt_build, llm, parse, tools, persist, broadcast).',
+    ['endpoint', 'stage'],
+    buckets=LATENCY_BUCKETS,
+)
+
+REDIS_PUBLISH_SECONDS = Histogram(
+    'neuralagent_redis_publish_duration_seconds',
+    'Time to publish one message to a thread channel.',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+
+class StepTimings:
+    """
+    Time spent per stage of one agent step. lap(stage) books the time since the previous lap, minus what
+    add() booked to other stages in between (e.g. broadcasts made during the LLM call), so stages don't overlap.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.durations = defaultdict(float)
+        self._last = time.perf_counter()
+        self._added = 0.0
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.durations[stage] += max(now - self._last - self._added, 0.0)
+        self._last = now
+        self._added = 0.0
+
+    def add(self, stage: str, seconds: float):
+        self.durations[stage] += seconds
+        self._added += seconds
+
+    def observe(self):
+        for name, seconds in self.durations.items():
+            STEP_STAGE_SECONDS.labels(self.endpoint, name).observe(seconds)
+        self.durations.clear()
+
+
+_step_timings: ContextVar[Optional[StepTimings]] = ContextVar('step_timings', default=None)
+
+
+def start_step_timings(endpoint: str) -> StepTimings:
+    """Timings of the current request's agent step, also seen by code it calls (e.g. broadcasts)."""
+    timings = StepTimings(endpoint)
+    _step_timings.set(timings)
+    return timings
+
+
+def current_step_timings() -> Optional[StepTimings]:
+    return _step_timings.get()
+
+
+# Each worker has its own pool, the gauges are summed over live workers (the peak is the highest of any worker)
+DB_POOL_GAUGES = {
+    key: Gauge(f'neuralagent_db_pool_{key}', f"Async DB connection pool {key.replace('_', ' ')}, over all workers.",
+               multiprocess_mode='livemax' if key == 'peak_checked_out' else 'livesum')
+    for key in ('pool_size', 'max_overflow', 'checked_out', 'checked_in', 'overflow', 'peak_checked_out')
+}
+
+LLM_IN_FLIGHT_CALLS = Gauge(
+    'neuralagent_llm_in_flight_calls',
+    'LLM calls currently waiting on the provider.',
+    ['provider', 'agent'],
+    multiprocess_mode='livesum',
+)
+
+
+def refresh_pool_gauges():
+    from db.database import get_pool_stats
+
+    pool = get_pool_stats()
+    for key, gauge in DB_POOL_GAUGES.items():
+        gauge.set(pool[key])
+
+
+async def _refresh_pool_gauges_forever():
+    while True:
+        refresh_pool_gauges()
+        await asyncio.sleep(RESOURCE_METRICS_INTERVAL)
+
+
+_refresh_task: Optional[asyncio.Task] = None
+
+
+def start_resource_metrics():
+    """
+    Keep this worker's pool gauges current. A scrape reaches one worker only, the others' values are
+    whatever they last wrote, so each worker refreshes them every RESOURCE_METRICS_INTERVAL seconds.
+    """
+    global _refresh_task
+    if _refresh_task is None:
+        _refresh_task = asyncio.create_task(_refresh_pool_gauges_forever())
+
+
+async def stop_resource_metrics():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Drops this worker's live gauges from the merged output
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def render_metrics() -> bytes:
+    refresh_pool_gauges()
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return generate_latest()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+async def metrics_middleware(request: Request, call_next):
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Route templates rather than raw paths, so thread ids don't turn into label values
+        route = request.scope.get('route')
+        REQUEST_SECONDS.labels(
+            request.method, getattr(route, 'path', 'unmatched'), str(status_code)
+        ).observe(time.perf_counter() - started)
+
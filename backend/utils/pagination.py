@@ -0,0 +1,49 @@
+import base64
+import datetime
+import json
+from typing import Optional
+from fastapi import status
+from sqlalchemy import tuple_
+from utils.procedures import CustomError
+
+
+MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(created_at: datetime.datetime, row_id) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.datetime.fromisoformat(created_at), row_id
+    except (ValueError, TypeError):
+        raise CustomError(status.HTTP_400_BAD_REQUEST, 'Invalid_Cursor')
+
+
+def keyset_page(query, created_at_column, id_column, cursor: Optional[str], limit: int, descending: bool = False):
+    """
+    Limits an ordered query to the page after `cursor`, keyed on (created_at, id) so the database seeks
+    straight to it through the index instead of skipping an offset. Fetches one extra row, see split_page.
+    """
+    key = tuple_(created_at_column, id_column)
+    if cursor:
+        after = tuple_(*decode_cursor(cursor))
+        query = query.where(key < after if descending else key > after)
+    if descending:
+        query = query.order_by(created_at_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(created_at_column.asc(), id_column.asc())
+    return query.limit(limit + 1)
+
+
+def split_page(rows: list, limit: int) -> tuple[list, Optional[str]]:
+    """(the page, cursor of the next page or None on the last one) from the rows of a keyset_page query."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
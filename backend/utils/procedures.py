@@ -50,3 +50,72 @@ def extract_json_array(raw: str):
     if not match:
         raise ValueError("No valid JSON array found in model response.")
     return json.loads(match.group(0))
+
+
+class IncrementalActionParser:
+    """
+    Parses the agent's JSON response while it is still being generated and returns each object of its
+    "actions" array as soon as that object is complete, so actions can be executed before the response ends.
+    Each action comes with its index in the array, elements that can't be parsed still take up their index.
+    """
+
+    ACTIONS_KEY = re.compile(r'"actions"\s*:\s*\[')
+
+    def __init__(self):
+        self.buffer = ''
+        self.done = False
+        self._pos = 0
+        self._in_array = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+        self._index = 0
+
+    def feed(self, text: str) -> list:
+        """Add the next piece of model output and return the (index, action) pairs it completed."""
+        self.buffer += text
+        if self.done:
+            return []
+
+        if not self._in_array:
+            match = self.ACTIONS_KEY.search(self.buffer, self._pos)
+            if not match:
+                # The key may be split across pieces, search the tail again next time
+                self._pos = max(0, len(self.buffer) - len('"actions" : ['))
+                return []
+            self._in_array = True
+            self._pos = match.end()
+
+        actions = []
+        while self._pos < len(self.buffer):
+            char = self.buffer[self._pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == ',' and self._depth == 0:
+                self._index += 1
+            elif char in '{[':
+                if self._depth == 0:
+                    self._object_start = self._pos
+                self._depth += 1
+            elif char in '}]':
+                if self._depth == 0:
+                    # End of the actions array
+                    self.done = True
+                    self._pos += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        actions.append((self._index, json.loads(self.buffer[self._object_start:self._pos + 1])))
+                    except ValueError:
+                        pass
+            self._pos += 1
+        return actions
@@ -0,0 +1,85 @@
+import os
+import threading
+from typing import List, Optional
+from langchain_core.messages import SystemMessage, HumanMessage
+
+
+PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', 'true') == 'true'
+
+# Providers that cache a marked prompt prefix and bill/serve later requests sharing it from the cache
+PROMPT_CACHE_MODEL_TYPES = ('anthropic', 'bedrock')
+
+_usage_lock = threading.Lock()
+_usage_totals = {}
+
+
+def prompt_cache_model_type(agent: str) -> Optional[str]:
+    model_type = os.getenv(f"{agent.upper()}_AGENT_MODEL_TYPE")
+    if PROMPT_CACHE_ENABLED and model_type in PROMPT_CACHE_MODEL_TYPES:
+        return model_type
+    return None
+
+
+def _mark_cached(blocks: List[dict], model_type: Optional[str]) -> List[dict]:
+    """Ends the cacheable prefix after the last of blocks."""
+    if not blocks or model_type is None:
+        return blocks
+    if model_type == 'anthropic':
+        return blocks[:-1] + [{**blocks[-1], 'cache_control': {'type': 'ephemeral'}}]
+    return blocks + [{'cachePoint': {'type': 'default'}}]
+
+
+def build_cached_messages(agent: str, system_prompt: str, stable_blocks: List[dict],
+                          dynamic_blocks: List[dict] = None) -> list:
+    """
+    Builds the system and user messages for an agent step with the parts that repeat between steps first:
+    the system prompt, then stable_blocks (e.g. the current subtask), then dynamic_blocks (UI state, screenshot).
+    For providers with prompt caching, the system prompt and the stable blocks are each marked as a cacheable
+    prefix, so a step only pays full input cost for what changed since the previous one.
+    """
+    model_type = prompt_cache_model_type(agent)
+    dynamic_blocks = dynamic_blocks or []
+
+    if model_type is None:
+        system_message = SystemMessage(content=system_prompt)
+    else:
+        system_message = SystemMessage(content=_mark_cached([{'type': 'text', 'text': system_prompt}], model_type))
+
+    return [
+        system_message,
+        HumanMessage(content=_mark_cached(list(stable_blocks), model_type) + list(dynamic_blocks)),
+    ]
+
+
+def report_usage(agent: str, usage_metadata: Optional[dict]):
+    """Logs a call's token usage including prompt cache reads/writes, and adds it to the per agent totals."""
+    if not usage_metadata:
+        return
+    details = usage_metadata.get('input_token_details') or {}
+    cache_read = details.get('cache_read') or 0
+    cache_creation = details.get('cache_creation') or 0
+    input_tokens = usage_metadata.get('input_tokens') or 0
+
+    print(f"Token Usage ({agent}): ", usage_metadata)
+    if cache_read or cache_creation:
+        print(f"Prompt cache ({agent}): {cache_read} read, {cache_creation} written of {input_tokens} input tokens")
+
+    with _usage_lock:
+        totals = _usage_totals.setdefault(agent, {
+            'calls': 0, 'input_tokens': 0, 'cache_read_tokens': 0, 'cache_creation_tokens': 0,
+        })
+        totals['calls'] += 1
+        totals['input_tokens'] += input_tokens
+        totals['cache_read_tokens'] += cache_read
+        totals['cache_creation_tokens'] += cache_creation
+
+
+def get_usage_stats() -> dict:
+    with _usage_lock:
+        return {
+            agent: {
+                **totals,
+                'cache_hit_ratio': totals['cache_read_tokens'] / totals['input_tokens'] if totals['input_tokens'] else 0.0,
+            }
+            for agent, totals in _usage_totals.items()
+        }
@@ -0,0 +1,150 @@
+import asyncio
+import io
+import os
+from typing import Optional
+from sqlmodel import update
+from db.database import AsyncSessionLocal
+from db.models import ThreadMessage
+from db.unit_of_work import StepUnitOfWork
+from db.write_behind import message_log_queue
+from .aws_s3 import upload_fileobj_async
+from .procedures import generate_random_string
+
+
+class ScreenshotUpload:
+    """A queued screenshot: the key it is stored under, whether the upload gave up and whether a row points at it."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.failed = False
+        self.persisted = False
+
+
+class ScreenshotUploadPipeline:
+    """
+    Uploads training screenshots in the background so agent steps don't wait on object storage.
+
+    submit() hands out the object key right away and queues the bytes for a fixed pool of upload workers
+    (the concurrency limit). Screenshots that would push the queued bytes over max_pending_bytes are dropped,
+    logging is best effort and must never hold the step or grow memory without bound.
+
+    A message only keeps the key of an upload that didn't fail: attach() leaves it out once the upload gave up,
+    and clears it from the saved message when the upload gives up afterwards.
+    """
+
+    def __init__(self, workers: int = 4, max_pending_bytes: int = 64 * 1024 * 1024, max_attempts: int = 3):
+        self.workers = workers
+        self.max_pending_bytes = max_pending_bytes
+        self.max_attempts = max_attempts
+        self.pending_bytes = 0
+        self.uploaded = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._clearing = set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, data: bytes, extension: str = 'png') -> Optional[ScreenshotUpload]:
+        """Queue a screenshot for upload, None if it was dropped. Pass the result to attach() for the message row."""
+        if not self.running:
+            self.start()
+
+        if self.pending_bytes + len(data) > self.max_pending_bytes:
+            self.dropped += 1
+            print(f"⚠️ Screenshot upload queue is full ({self.pending_bytes} bytes pending), dropping screenshot")
+            return None
+
+        upload = ScreenshotUpload(f"neuralagent_screenshots/{generate_random_string()}.{extension}")
+        self.pending_bytes += len(data)
+        self._queue.put_nowait((upload, data))
+        return upload
+
+    def attach(self, upload: Optional[ScreenshotUpload], uow: StepUnitOfWork) -> Optional[str]:
+        """The key to store in a message row committed by uow, None once the upload has failed."""
+        if upload is None or upload.failed:
+            return None
+
+        def persisted():
+            upload.persisted = True
+            # The upload gave up while the step was being committed
+            if upload.failed:
+                self._clear_key_later(upload.key)
+
+        uow.on_commit(persisted)
+        return upload.key
+
+    async def _worker(self):
+        while True:
+            upload, data = await self._queue.get()
+            try:
+                for attempt in range(1, self.max_attempts + 1):
+                    try:
+                        await upload_fileobj_async(io.BytesIO(data), upload.key)
+                        self.uploaded += 1
+                        break
+                    except Exception as e:
+                        if attempt == self.max_attempts:
+                            self.failed += 1
+                            upload.failed = True
+                            print(f"❌ Failed to upload screenshot {upload.key}: {e}")
+                            if upload.persisted:
+                                await self._clear_key(upload.key)
+                        else:
+                            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            finally:
+                self.pending_bytes -= len(data)
+                self._queue.task_done()
+
+    def _clear_key_later(self, key: str):
+        task = asyncio.create_task(self._clear_key(key))
+        self._clearing.add(task)
+        task.add_done_callback(self._clearing.discard)
+
+    async def _clear_key(self, key: str):
+        """Remove the key of a screenshot that was never uploaded from the message that points at it."""
+        try:
+            # With MESSAGE_LOG_DURABILITY=async the message may still be queued
+            await message_log_queue.flush()
+            async with AsyncSessionLocal() as session:
+                await session.exec(update(ThreadMessage).where(ThreadMessage.screenshot == key).values(screenshot=None))
+                await session.commit()
+        except Exception as e:
+            print(f"❌ Failed to clear the key of screenshot {key} that was never uploaded: {e}")
+
+    async def stop(self, timeout: float = 30.0):
+        """Give queued uploads up to timeout seconds to finish, then stop the workers."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Stopping screenshot uploads with {self._queue.qsize()} still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._clearing, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            'queued': self._queue.qsize() if self._queue else 0,
+            'pending_bytes': self.pending_bytes,
+            'uploaded': self.uploaded,
+            'failed': self.failed,
+            'dropped': self.dropped,
+        }
+
+
+screenshot_uploader = ScreenshotUploadPipeline(
+    workers=int(os.getenv('SCREENSHOT_UPLOAD_WORKERS', '4')),
+    max_pending_bytes=int(os.getenv('SCREENSHOT_UPLOAD_MAX_PENDING_MB', '64')) * 1024 * 1024,
+)
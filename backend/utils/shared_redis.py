@@ -0,0 +1,38 @@
+import os
+from typing import Optional
+
+
+# Redis client for per-thread state that every uvicorn worker must see (UI snapshots, last screenshots),
+# on the REDIS_CONNECTION the WebSocket broadcasts already use. None when Redis isn't configured or reachable,
+# the stores then fall back to process-local caches, which only work with requests of a thread sticking
+# to one worker.
+_client = None
+
+
+async def connect_shared_redis():
+    global _client
+    redis_connection = os.getenv('REDIS_CONNECTION')
+    if not redis_connection or os.getenv('AGENT_STATE_SHARED', 'true') != 'true':
+        print("⚠️ Agent UI state and screenshots are kept per worker, route a thread's requests to one worker")
+        return
+
+    try:
+        from redis import asyncio as aioredis
+
+        _client = aioredis.from_url(redis_connection)
+        await _client.ping()
+        print("✅ Agent UI state and screenshots shared through Redis")
+    except Exception as e:
+        print(f"❌ Redis for shared agent state failed, keeping it per worker: {e}")
+        _client = None
+
+
+def shared_redis() -> Optional[object]:
+    return _client
+
+
+async def close_shared_redis():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
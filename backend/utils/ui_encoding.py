@@ -0,0 +1,49 @@
+import json
+import os
+
+
+UI_ENCODINGS = ('json', 'table')
+
+TABLE_COLUMNS = ('id', 'type', 'label', 'x', 'y', 'width', 'height')
+
+
+def get_ui_encoding(agent: str) -> str:
+    encoding = os.getenv(f"{agent.upper()}_AGENT_UI_ENCODING", 'json')
+    if encoding not in UI_ENCODINGS:
+        raise ValueError(f"Unsupported UI encoding '{encoding}' for agent '{agent}'")
+    return encoding
+
+
+def _table_cell(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        value = round(value)
+    return str(value).replace('|', '/').replace('\n', ' ').strip()
+
+
+def encode_elements_table(elements: list) -> str:
+    """
+    Header row followed by one `|` separated line per element, instead of repeating every key for every element.
+    Coordinates are rounded, missing labels and bounding boxes are left empty.
+    """
+    lines = ['|'.join(TABLE_COLUMNS)]
+    for element in elements:
+        bounding_box = element.get('bounding_box') or {}
+        lines.append('|'.join(_table_cell(value) for value in (
+            element.get('id'),
+            element.get('type'),
+            element.get('label'),
+            bounding_box.get('x'),
+            bounding_box.get('y'),
+            bounding_box.get('width'),
+            bounding_box.get('height'),
+        )))
+    return '\n'.join(lines)
+
+
+def encode_interactive_elements(agent: str, elements: list) -> str:
+    """Interactive elements as prompt text, in the encoding configured for the agent ({AGENT}_AGENT_UI_ENCODING)."""
+    if get_ui_encoding(agent) == 'table':
+        return '\n' + encode_elements_table(elements)
+    return json.dumps(elements)
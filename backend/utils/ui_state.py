@@ -0,0 +1,170 @@
+import json
+import os
+from collections import OrderedDict
+from typing import Optional
+from schemas.aiagent import UIStateDelta
+from utils.ai_helpers import Screenshot
+from utils.procedures import generate_random_string
+from utils.ttl_cache import TTLCache
+from utils.shared_redis import shared_redis
+
+
+UI_PROMPT_MODES = ('full', 'delta')
+
+
+def get_ui_prompt_mode(agent: str) -> str:
+    """'full': the model always gets the whole element list, 'delta': only what changed since the previous step."""
+    mode = os.getenv(f"{agent.upper()}_AGENT_UI_PROMPT_MODE", 'full')
+    if mode not in UI_PROMPT_MODES:
+        raise ValueError(f"Unsupported UI prompt mode '{mode}' for agent '{agent}'")
+    return mode
+
+
+def keyed_elements(elements: list) -> OrderedDict:
+    """
+    Elements keyed by type and label, numbered in order when the same type and label appear more than once.
+    Element ids are positions in the extracted list, so they can't identify an element across snapshots.
+    The desktop agent keys its elements the same way.
+    """
+    keyed = OrderedDict()
+    seen = {}
+    for element in elements:
+        base = f"{element.get('type')}|{element.get('label') or ''}"
+        keyed[f"{base}#{seen.get(base, 0)}"] = element
+        seen[base] = seen.get(base, 0) + 1
+    return keyed
+
+
+class UISnapshot:
+    def __init__(self, snapshot_id: str, elements: OrderedDict, changes: Optional[dict] = None):
+        self.id = snapshot_id
+        self.elements = elements
+        self.changes = changes
+
+    def element_list(self) -> list:
+        return [{**element, 'id': idx} for idx, element in enumerate(self.elements.values())]
+
+
+class UIStateStore:
+    """
+    Last UI snapshot received per thread, so the desktop agent can send only what changed since the snapshot
+    the server acknowledged. Kept in the shared Redis (utils/shared_redis.py) so any worker can apply the
+    next delta. Without it snapshots are process-local, a delta against a snapshot this worker doesn't have
+    is rejected and the agent resends its full state, so deltas then need sticky routing.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    async def apply(self, thread_id: str, elements: list, delta: Optional[UIStateDelta]) -> Optional[UISnapshot]:
+        """Store the step's UI state and return it, or None if delta is based on an unknown snapshot."""
+        if delta is None:
+            snapshot = UISnapshot(generate_random_string(16), keyed_elements(elements))
+            await self._save(thread_id, snapshot)
+            return snapshot
+
+        base = await self._load(thread_id)
+        if base is None or base.id != delta.base_snapshot_id:
+            return None
+
+        removed = set(delta.removed)
+        rebuilt = OrderedDict((key, element) for key, element in base.elements.items() if key not in removed)
+        for key, bounding_box in delta.moved.items():
+            if key in rebuilt:
+                rebuilt[key] = {**rebuilt[key], 'bounding_box': bounding_box}
+        rebuilt.update(delta.added)
+
+        changes = {
+            'added': [{key: value for key, value in element.items() if key != 'id'} for element in delta.added.values()],
+            'removed': [self._describe(base.elements[key]) for key in delta.removed if key in base.elements],
+            'moved': [{**self._describe(rebuilt[key]), 'bounding_box': bounding_box}
+                      for key, bounding_box in delta.moved.items() if key in rebuilt],
+        }
+        snapshot = UISnapshot(generate_random_string(16), rebuilt, changes)
+        await self._save(thread_id, snapshot)
+        return snapshot
+
+    async def _load(self, thread_id: str) -> Optional[UISnapshot]:
+        redis = shared_redis()
+        if redis is None:
+            return self._cache.get(thread_id)
+        try:
+            raw = await redis.get(f'ui_state:{thread_id}')
+        except Exception as e:
+            print(f"⚠️ Could not read the UI snapshot of thread {thread_id}: {e}")
+            return None
+        if not raw:
+            return None
+        data = json.loads(raw)
+        return UISnapshot(data['id'], OrderedDict(data['elements']))
+
+    async def _save(self, thread_id: str, snapshot: UISnapshot):
+        redis = shared_redis()
+        if redis is None:
+            self._cache.set(thread_id, snapshot)
+            return
+        try:
+            await redis.set(f'ui_state:{thread_id}', json.dumps({
+                'id': snapshot.id,
+                'elements': list(snapshot.elements.items()),
+            }), ex=int(self.ttl))
+        except Exception as e:
+            # The next delta is rejected and the agent resends its full state
+            print(f"⚠️ Could not store the UI snapshot of thread {thread_id}: {e}")
+
+    @staticmethod
+    def _describe(element: dict) -> dict:
+        return {'type': element.get('type'), 'label': element.get('label')}
+
+
+ui_state_store = UIStateStore(
+    ttl=float(os.getenv('UI_STATE_SNAPSHOT_TTL', '1800')),
+    max_size=int(os.getenv('UI_STATE_SNAPSHOT_MAX_SIZE', '1000')),
+)
+
+
+class ScreenshotCache:
+    """
+    Last screenshot the desktop agent sent per thread, reused when it reports the screen as unchanged.
+    Kept in the shared Redis (one key per thread, overwritten every step) so any worker can reuse it,
+    otherwise process-local and capped by total bytes rather than entry count, screenshots are large.
+    """
+
+    def __init__(self, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self._cache = TTLCache(max_size=10000, ttl=ttl, max_bytes=max_bytes, sizeof=lambda shot: shot.size)
+
+    async def get(self, thread_id: str) -> Optional[Screenshot]:
+        redis = shared_redis()
+        if redis is None:
+            return self._cache.get(thread_id)
+        try:
+            entry = await redis.hgetall(f'screenshot:{thread_id}')
+        except Exception as e:
+            print(f"⚠️ Could not read the last screenshot of thread {thread_id}: {e}")
+            return None
+        if not entry:
+            return None
+        return Screenshot(entry[b'media_type'].decode(), data=entry[b'data'])
+
+    async def set(self, thread_id: str, screenshot: Screenshot):
+        redis = shared_redis()
+        if redis is None:
+            self._cache.set(thread_id, screenshot)
+            return
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.hset(f'screenshot:{thread_id}', mapping={'media_type': screenshot.media_type,
+                                                              'data': screenshot.data})
+                pipe.expire(f'screenshot:{thread_id}', int(self.ttl))
+                await pipe.execute()
+        except Exception as e:
+            # The next screenshot_unchanged request gets a 409 and the agent sends the screenshot
+            print(f"⚠️ Could not store the last screenshot of thread {thread_id}: {e}")
+
+
+last_screenshot_cache = ScreenshotCache(
+    ttl=float(os.getenv('SCREENSHOT_CACHE_TTL', '600')),
+    max_bytes=int(os.getenv('SCREENSHOT_CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+)
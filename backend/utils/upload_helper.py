@@ -1,10 +1,12 @@
-from .aws_s3 import get_s3_client, generate_signed_url
+from .aws_s3 import upload_fileobj, upload_fileobj_async, generate_signed_url
 from fastapi import HTTPException
 import os
 from .procedures import generate_random_string
 from PIL import Image
 import io
 import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 
 def upload_file_s3(file):
@@ -13,12 +15,7 @@ def upload_file_s3(file):
         new_filename = '{}.{}'.format(generate_random_string(), ext)
         filepath = '{}/{}'.format('neuralagent_clients', new_filename)
 
-        s3_client = get_s3_client()
-        s3_client.upload_fileobj(
-            file.file,
-            os.getenv('AWS_BUCKET'),
-            filepath
-        )
+        upload_fileobj(file.file, filepath)
 
         return filepath
     except Exception as e:
@@ -30,12 +27,7 @@ def upload_screenshot_s3_bytesio(buffer: io.BytesIO, extension="png"):
         new_filename = f"{generate_random_string()}.{extension}"
         filepath = f"neuralagent_screenshots/{new_filename}"
 
-        s3_client = get_s3_client()
-        s3_client.upload_fileobj(
-            buffer,
-            os.getenv('AWS_BUCKET'),
-            filepath
-        )
+        upload_fileobj(buffer, filepath)
 
         return filepath
     except Exception as e:
@@ -43,69 +35,86 @@ def upload_screenshot_s3_bytesio(buffer: io.BytesIO, extension="png"):
 
 
 async def upload_screenshot_s3_bytesio_async(buffer: io.BytesIO, extension="png"):
-    """
-    Async wrapper for the synchronous upload function using thread pool
-    """
-    # Run the synchronous function in a thread pool
-    return await asyncio.to_thread(
-        upload_screenshot_s3_bytesio,
-        buffer,
-        extension
-    )
+    try:
+        new_filename = f"{generate_random_string()}.{extension}"
+        filepath = f"neuralagent_screenshots/{new_filename}"
+
+        await upload_fileobj_async(buffer, filepath)
+
+        return filepath
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to upload to S3: {e}")
+
+
+THUMBNAIL_SIZES = {
+    'thumb_sm': (200, 200),
+    'thumb_lg': (700, 700),
+}
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '2'))
 
+_thumbnail_executor = None
 
-def generate_thumbnail(image_data, size):
+
+def generate_thumbnails(image_data, sizes):
     """
-        Generate a thumbnail of the given size.
+        Generate a thumbnail for every size from a single decode of the image.
 
         :param image_data: Binary image data.
-        :param size: Tuple (width, height) for the thumbnail.
-        :return: BytesIO object containing the resized image.
+        :param sizes: Dict of name -> (width, height), aspect ratio is preserved.
+        :return: Dict of name -> encoded thumbnail bytes, in the image's original format.
         """
     image = Image.open(io.BytesIO(image_data))
-    image.thumbnail(size)  # Resize the image while maintaining aspect ratio
-
-    # Save thumbnail to a BytesIO object
-    thumb_io = io.BytesIO()
-    image.save(thumb_io, format=image.format)
-    thumb_io.seek(0)
-    return thumb_io
+    image_format = image.format
+    largest = max(sizes.values())
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale, no need to decode full resolution for a 700px thumbnail
+    image.draft(image.mode, largest)
+    image.load()
+
+    thumbnails = {}
+    # Shrink from largest to smallest, each thumbnail starting from the previous (already smaller) one
+    for name, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        image = image.copy()
+        image.thumbnail(size)
+        thumb_io = io.BytesIO()
+        image.save(thumb_io, format=image_format)
+        thumbnails[name] = thumb_io.getvalue()
+    return thumbnails
+
+
+async def generate_thumbnails_async(image_data, sizes=THUMBNAIL_SIZES):
+    """Runs generate_thumbnails in a process pool, decoding and resizing are CPU bound and hold the GIL."""
+    global _thumbnail_executor
+    if _thumbnail_executor is None:
+        # Spawned rather than forked, forking a process that already runs threads (the event loop's executors)
+        # can copy locks held by them into the children
+        _thumbnail_executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS,
+                                                  mp_context=multiprocessing.get_context('spawn'))
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_thumbnail_executor, generate_thumbnails, image_data, sizes)
+
+
+def shutdown_thumbnail_executor():
+    global _thumbnail_executor
+    if _thumbnail_executor is not None:
+        _thumbnail_executor.shutdown(cancel_futures=True)
+        _thumbnail_executor = None
 
 
 async def upload_image_s3(image):
     image_data = await image.read()
-    thumb_sm = generate_thumbnail(image_data, (200, 200))
-    thumb_lg = generate_thumbnail(image_data, (700, 700))
+    thumbnails = await generate_thumbnails_async(image_data)
 
     ext = image.filename.split('.')[-1]
     random_string = generate_random_string()
 
     new_filename = '{}.{}'.format(random_string, ext)
-    thumb_sm_name = '{}.thumb_sm.{}'.format(random_string, ext)
-    thumb_lg_name = '{}.thumb_lg.{}'.format(random_string, ext)
-
     filepath = '{}/{}'.format('neuralagent_clients', new_filename)
-    thumb_sm_path = '{}/{}'.format('neuralagent_clients', thumb_sm_name)
-    thumb_lg_path = '{}/{}'.format('neuralagent_clients', thumb_lg_name)
-
-    s3_client = get_s3_client()
-    s3_client.upload_fileobj(
-        image.file,
-        os.getenv('AWS_BUCKET'),
-        filepath
-    )
-
-    s3_client.upload_fileobj(
-        thumb_sm,
-        os.getenv('AWS_BUCKET'),
-        thumb_sm_path
-    )
-
-    s3_client.upload_fileobj(
-        thumb_lg,
-        os.getenv('AWS_BUCKET'),
-        thumb_lg_path
-    )
+
+    uploads = [upload_fileobj_async(io.BytesIO(image_data), filepath)]
+    for name, thumbnail in thumbnails.items():
+        thumb_path = '{}/{}.{}.{}'.format('neuralagent_clients', random_string, name, ext)
+        uploads.append(upload_fileobj_async(io.BytesIO(thumbnail), thumb_path))
+    await asyncio.gather(*uploads)
 
     return filepath
 
@@ -1,4 +1,3 @@
-import base64
 import time
 import requests
 import pyautogui
@@ -6,7 +5,6 @@ import mss
 import os
 import subprocess
 import platform
-from io import BytesIO
 from PIL import Image
 import webbrowser
 import sys
@@ -17,6 +15,7 @@ import json
 import asyncio
 import logging
 import ui_extraction
+from screenshot_encoder import ScreenshotEncoder, screenshot_request
 
 pyautogui.FAILSAFE = False
 
@@ -182,20 +181,43 @@ def focus_app(app_name):
 
     return False
 
-def take_screenshot_b64():
+# Coordinates the model returns are relative to 1280x720, so screenshots always have that size
+screenshot_encoder = ScreenshotEncoder.from_env(image_format='png', size=(1280, 720))
+
+
+def capture_screenshot():
+    with mss.mss() as sct:
+        monitor = sct.monitors[1]
+        shot = sct.grab(monitor)
+        img = Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")
+        return screenshot_encoder.resize(img)
+
+
+def take_screenshot():
+    """Encoded screenshot bytes, or None if capturing failed."""
     try:
-        with mss.mss() as sct:
-            monitor = sct.monitors[1]
-            shot = sct.grab(monitor)
-            img = Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")
-            img = img.resize((1280, 720))
-            buffer = BytesIO()
-            img.save(buffer, format="PNG")
-            return base64.b64encode(buffer.getvalue()).decode("utf-8")
+        return screenshot_encoder.encode(capture_screenshot())
     except Exception as e:
         print(f"⚠️ Screenshot failed: {e}")
         return None
 
+
+# Screenshots are compared as 64x36 grids of average brightness (20x20 px blocks at 1280x720). The screen counts
+# as changed once any block moves by more than the threshold, e.g. a typed character, a checkbox tick or a toast.
+SCREENSHOT_HASH_SIZE = (64, 36)
+SCREENSHOT_DIFF_THRESHOLD = int(os.getenv('NEURALAGENT_SCREENSHOT_DIFF_THRESHOLD', '2'))
+SCREENSHOT_DEDUPE_ENABLED = os.getenv('NEURALAGENT_SCREENSHOT_DEDUPE', 'false').lower() == 'true'
+
+
+def screenshot_block_hash(img):
+    return img.convert("L").resize(SCREENSHOT_HASH_SIZE, Image.BOX).tobytes()
+
+
+def screenshot_changed(previous_hash, current_hash):
+    if previous_hash is None or len(previous_hash) != len(current_hash):
+        return True
+    return any(abs(a - b) > SCREENSHOT_DIFF_THRESHOLD for a, b in zip(previous_hash, current_hash))
+
 def safe_coords(x, y, screen_width, screen_height):
     return max(1, min(screen_width - 1, x)), max(1, min(screen_height - 1, y))
 
@@ -339,34 +361,132 @@ def perform_action(response):
             print("❌ Exception in perform_action:", e)
 
 
+STREAM_NEXT_STEP = os.getenv('NEURALAGENT_STREAM_NEXT_STEP', 'false').lower() == 'true'
+
+# Actions that only end the loop, there is nothing to perform for them
+TERMINAL_ACTIONS = ['task_completed', 'subtask_failed']
+
+
+UI_DELTA_ENABLED = os.getenv('NEURALAGENT_UI_DELTA', 'false').lower() == 'true'
+
+# UI state the server acknowledged (X-UI-Snapshot-Id), later steps only send what changed since
+acked_ui_state = {'id': None, 'elements': {}}
+# Block hash of the last screenshot the server received
+acked_screenshot_hash = None
+
+
+def keyed_elements(elements):
+    """Elements keyed by type and label, numbered when repeated. Mirrors backend utils/ui_state.py."""
+    keyed = {}
+    seen = {}
+    for element in elements:
+        base = f"{element.get('type')}|{element.get('label') or ''}"
+        keyed[f"{base}#{seen.get(base, 0)}"] = element
+        seen[base] = seen.get(base, 0) + 1
+    return keyed
+
+
+def diff_ui_state(previous, current):
+    return {
+        'added': {key: element for key, element in current.items() if key not in previous},
+        'removed': [key for key in previous if key not in current],
+        'moved': {
+            key: element.get('bounding_box') for key, element in current.items()
+            if key in previous and previous[key].get('bounding_box') != element.get('bounding_box')
+        },
+    }
+
+
+def build_next_step_payload():
+    """
+    Returns the next_step payload, the keyed UI state it describes, the screenshot taken for it (image and block
+    hash) and the encoded screenshot to send, if any.
+    """
+    global screenshot_requested
+    interactive_elements = ui_extraction.extract_interactive_elements()
+    running_apps = ui_extraction.get_running_apps()
+    ui_state = keyed_elements(interactive_elements)
+
+    # Automatically trigger screenshot if WebView is present
+    has_webview = any(e.get("type") == "PossibleWebView" for e in interactive_elements)
+    should_send_screenshot = screenshot_requested or has_webview
+
+    payload = {
+        'current_os': 'MacOS' if platform.system() == 'darwin' else platform.system(),
+        'current_running_apps': running_apps,
+        'screenshot_media_type': screenshot_encoder.media_type,
+    }
+
+    if UI_DELTA_ENABLED and acked_ui_state['id']:
+        payload['ui_delta'] = {
+            'base_snapshot_id': acked_ui_state['id'],
+            **diff_ui_state(acked_ui_state['elements'], ui_state),
+        }
+    else:
+        payload['current_interactive_elements'] = interactive_elements
+
+    screenshot = None
+    if should_send_screenshot:
+        screenshot_requested = False
+        try:
+            img = capture_screenshot()
+            screenshot = (img, screenshot_block_hash(img))
+        except Exception as e:
+            print(f"⚠️ Screenshot failed: {e}")
+
+    screenshot_data = None
+    if screenshot:
+        if SCREENSHOT_DEDUPE_ENABLED and not screenshot_changed(acked_screenshot_hash, screenshot[1]):
+            # The server reuses the screenshot it already has
+            payload['screenshot_unchanged'] = True
+        else:
+            screenshot_data = screenshot_encoder.encode(screenshot[0])
+
+    return payload, ui_state, screenshot, screenshot_data
+
+
+def send_next_step(url, headers, payload, screenshot_data, stream):
+    request_url, request_kwargs = screenshot_request(url, payload, headers, screenshot_data,
+                                                     screenshot_encoder.media_type)
+    return requests.post(request_url, stream=stream, **request_kwargs)
+
+
+def post_next_step(url, headers, stream=False):
+    global acked_screenshot_hash
+    payload, ui_state, screenshot, screenshot_data = build_next_step_payload()
+    response = send_next_step(url, headers, payload, screenshot_data, stream)
+
+    if response.status_code == 409 and ('ui_delta' in payload or payload.get('screenshot_unchanged')):
+        # The server doesn't have our base snapshot or last screenshot anymore (restart, another worker),
+        # send the full state
+        response.close()
+        if payload.pop('ui_delta', None):
+            payload['current_interactive_elements'] = list(ui_state.values())
+        if payload.pop('screenshot_unchanged', None):
+            screenshot_data = screenshot_encoder.encode(screenshot[0])
+        response = send_next_step(url, headers, payload, screenshot_data, stream)
+
+    if response.status_code in (200, 201, 202):
+        acked_ui_state['id'] = response.headers.get('X-UI-Snapshot-Id')
+        acked_ui_state['elements'] = ui_state
+        if screenshot_data is not None:
+            acked_screenshot_hash = screenshot[1]
+    else:
+        acked_ui_state['id'] = None
+        acked_screenshot_hash = None
+
+    return response
+
 def get_next_step():
     try:
-        global screenshot_requested
         url = os.getenv('NEURALAGENT_API_URL') + '/aiagent/' + os.getenv('NEURALAGENT_THREAD_ID') + '/next_step'
         headers = {
             'Content-Type': 'application/json',
             'Authorization': 'Bearer ' + os.getenv('NEURALAGENT_USER_ACCESS_TOKEN'),
         }
 
-        interactive_elements = ui_extraction.extract_interactive_elements()
-        running_apps = ui_extraction.get_running_apps()
-
-        # Automatically trigger screenshot if WebView is present
-        has_webview = any(e.get("type") == "PossibleWebView" for e in interactive_elements)
-        should_send_screenshot = screenshot_requested or has_webview
-
-        payload = {
-            'current_os': 'MacOS' if platform.system() == 'darwin' else platform.system(),
-            'current_interactive_elements': interactive_elements,
-            'current_running_apps': running_apps,
-        }
-
-        if should_send_screenshot:
-            payload['screenshot_b64'] = take_screenshot_b64()
-            screenshot_requested = False
-
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = post_next_step(url, headers)
             if response.status_code in (200, 201, 202):
                 return response.json()
         except Exception as e:
@@ -380,6 +500,60 @@ def get_next_step():
     
     return None
 
+
+def stream_next_step():
+    """
+    Streaming variant of get_next_step: performs each action as soon as the backend has parsed it, while the
+    model is still writing the rest of the response. Returns the full response once the step is done.
+    """
+    try:
+        url = os.getenv('NEURALAGENT_API_URL') + '/aiagent/' + os.getenv('NEURALAGENT_THREAD_ID') + '/next_step/stream'
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+            'Authorization': 'Bearer ' + os.getenv('NEURALAGENT_USER_ACCESS_TOKEN'),
+        }
+
+        # Indices (in the response's actions array, sent as the event id) of the actions already performed
+        performed = set()
+
+        with post_next_step(url, headers, stream=True) as response:
+            if response.status_code not in (200, 201, 202):
+                return None
+
+            event, event_id, data_lines = None, None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                elif line.startswith('id:'):
+                    event_id = line[len('id:'):].strip()
+                elif line.startswith('data:'):
+                    data_lines.append(line[len('data:'):].strip())
+                elif line == '' and event:
+                    data = json.loads('\n'.join(data_lines))
+                    if event == 'action' and event_id is not None:
+                        index = int(event_id)
+                        if index not in performed and data.get('action') not in TERMINAL_ACTIONS:
+                            perform_action({'actions': [data]})
+                        performed.add(index)
+                    elif event == 'result':
+                        # Anything the incremental parser could not pick up is performed from the full response
+                        remaining = [a for index, a in enumerate(data.get('actions', []))
+                                     if index not in performed and a.get('action') not in TERMINAL_ACTIONS]
+                        if remaining:
+                            perform_action({'actions': remaining})
+                        return data
+                    elif event == 'error':
+                        print(f"[❌] Next step failed: {data.get('message')}")
+                        return None
+                    event, event_id, data_lines = None, None, []
+    except requests.exceptions.Timeout:
+        print("⚠️ Request timed out")
+    except Exception as e:
+        print(f"⚠️ Error in stream_next_step: {e}")
+
+    return None
+
 def get_current_subtask():
     try:
         url = os.getenv('NEURALAGENT_API_URL') + '/aiagent/' + os.getenv('NEURALAGENT_THREAD_ID') + '/current_subtask'
@@ -420,11 +594,13 @@ def get_suggestions():
             "current_os": "MacOS" if platform.system() == "darwin" else platform.system(),
             "current_interactive_elements": ui_extraction.extract_interactive_elements(),
             "current_running_apps": ui_extraction.get_running_apps(),
-            "screenshot_b64": take_screenshot_b64(),
+            "screenshot_media_type": screenshot_encoder.media_type,
         }
 
         try:
-            response = requests.post(api_url, json=payload, headers=headers)
+            request_url, request_kwargs = screenshot_request(api_url, payload, headers, take_screenshot(),
+                                                             screenshot_encoder.media_type)
+            response = requests.post(request_url, **request_kwargs)
             if response.status_code in (200, 201):
                 return response.json()
             else:
@@ -475,16 +651,21 @@ async def main_loop():
             if current_subtask_response.get('action') == 'task_completed':
                 break
 
-            action_response = get_next_step()
+            if STREAM_NEXT_STEP:
+                # Actions are performed while the response streams in
+                action_response = stream_next_step()
+            else:
+                action_response = get_next_step()
             print("NeuralAgent Next Step Response:", action_response)
 
             if not action_response:
                 continue
 
-            if any(a['action'] in ['task_completed', 'subtask_failed'] for a in action_response.get('actions', [])):
+            if any(a['action'] in TERMINAL_ACTIONS for a in action_response.get('actions', [])):
                 break
 
-            perform_action(action_response)
+            if not STREAM_NEXT_STEP:
+                perform_action(action_response)
         except:
             continue
 
@@ -0,0 +1,120 @@
+"""
+Screenshot encoding shared by the desktop and background agents (windows_background_mode/aiagent keeps a copy,
+it is built as a separate binary).
+
+Configured through environment variables:
+    NEURALAGENT_SCREENSHOT_FORMAT     png | jpeg | webp
+    NEURALAGENT_SCREENSHOT_QUALITY    starting quality for jpeg/webp (1-100)
+    NEURALAGENT_SCREENSHOT_RESAMPLE   nearest | box | bilinear | bicubic | lanczos
+    NEURALAGENT_SCREENSHOT_MAX_BYTES  byte budget, jpeg/webp quality is lowered step by step (down to 30) to fit
+    NEURALAGENT_BINARY_SCREENSHOTS    true to send screenshots as multipart file parts instead of base64 in JSON
+"""
+import base64
+import json
+import os
+from io import BytesIO
+from PIL import Image
+
+
+FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+RESAMPLE_FILTERS = {
+    'nearest': Image.Resampling.NEAREST,
+    'box': Image.Resampling.BOX,
+    'bilinear': Image.Resampling.BILINEAR,
+    'bicubic': Image.Resampling.BICUBIC,
+    'lanczos': Image.Resampling.LANCZOS,
+}
+
+QUALITY_STEP = 10
+
+
+class ScreenshotEncoder:
+    def __init__(self, image_format='png', quality=80, size=None, resample='bilinear', max_bytes=None,
+                 min_quality=30):
+        if image_format not in FORMATS:
+            raise ValueError(f"Unsupported screenshot format '{image_format}'")
+        self.image_format = image_format
+        self.quality = quality
+        self.size = size
+        self.resample = RESAMPLE_FILTERS[resample]
+        self.max_bytes = max_bytes
+        self.min_quality = min_quality
+
+    @classmethod
+    def from_env(cls, image_format='png', quality=80, size=None, resample='bilinear'):
+        """Encoder configured from NEURALAGENT_SCREENSHOT_* variables, the arguments are the defaults."""
+        max_bytes = os.getenv('NEURALAGENT_SCREENSHOT_MAX_BYTES')
+        return cls(
+            image_format=os.getenv('NEURALAGENT_SCREENSHOT_FORMAT', image_format).lower(),
+            quality=int(os.getenv('NEURALAGENT_SCREENSHOT_QUALITY', quality)),
+            size=size,
+            resample=os.getenv('NEURALAGENT_SCREENSHOT_RESAMPLE', resample).lower(),
+            max_bytes=int(max_bytes) if max_bytes else None,
+        )
+
+    @property
+    def media_type(self):
+        return FORMATS[self.image_format][1]
+
+    def resize(self, img):
+        if not self.size or img.size == self.size:
+            return img
+        # reducing_gap shrinks by an integer factor first (cheap), then applies the filter on the smaller image
+        return img.resize(self.size, self.resample, reducing_gap=2.0)
+
+    def _save(self, img, quality):
+        buffer = BytesIO()
+        pil_format = FORMATS[self.image_format][0]
+        if self.image_format == 'png':
+            # Screens compress well even at the fastest zlib level, higher levels mostly cost time
+            img.save(buffer, format=pil_format, compress_level=1)
+        elif self.image_format == 'webp':
+            img.save(buffer, format=pil_format, quality=quality, method=0)
+        else:
+            img.save(buffer, format=pil_format, quality=quality)
+        return buffer.getvalue()
+
+    def encode(self, img):
+        """Encoded bytes of img (resized to size, if set). Lossy formats step quality down to fit max_bytes."""
+        img = self.resize(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        quality = self.quality
+        data = self._save(img, quality)
+        while (self.max_bytes and len(data) > self.max_bytes and self.image_format != 'png'
+               and quality - QUALITY_STEP >= self.min_quality):
+            quality -= QUALITY_STEP
+            data = self._save(img, quality)
+        return data
+
+    def encode_b64(self, img):
+        return base64.b64encode(self.encode(img)).decode('utf-8')
+
+
+BINARY_SCREENSHOTS = os.getenv('NEURALAGENT_BINARY_SCREENSHOTS', 'false').lower() == 'true'
+
+
+def screenshot_request(url, payload, headers, screenshot_data=None, media_type='image/png'):
+    """
+    URL and requests.post keyword arguments for an agent endpoint. With NEURALAGENT_BINARY_SCREENSHOTS the
+    screenshot goes out as raw bytes to the endpoint's /multipart variant (payload as a JSON form field),
+    otherwise base64 encoded inside the JSON body.
+    """
+    if screenshot_data is None:
+        return url, {'json': payload, 'headers': headers}
+    if BINARY_SCREENSHOTS:
+        extension = media_type.split('/')[-1]
+        return url + '/multipart', {
+            'data': {'payload': json.dumps(payload)},
+            'files': {'screenshot': (f'screenshot.{extension}', screenshot_data, media_type)},
+            # requests sets the multipart boundary itself
+            'headers': {key: value for key, value in headers.items() if key.lower() != 'content-type'},
+        }
+    screenshot_b64 = base64.b64encode(screenshot_data).decode('utf-8')
+    return url, {'json': {**payload, 'screenshot_b64': screenshot_b64}, 'headers': headers}
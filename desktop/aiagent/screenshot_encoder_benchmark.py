@@ -0,0 +1,65 @@
+"""
+Times capture -> resize -> encode -> base64 for each screenshot encoder option and reports the payload size.
+
+    python screenshot_encoder_benchmark.py                 # captures the primary monitor with mss
+    python screenshot_encoder_benchmark.py --image shot.png --runs 20
+"""
+import argparse
+import base64
+import itertools
+import statistics
+import time
+from PIL import Image
+from screenshot_encoder import ScreenshotEncoder
+
+
+FORMATS = [('png', None), ('jpeg', 85), ('jpeg', 60), ('webp', 80), ('webp', 60)]
+RESAMPLES = ['nearest', 'bilinear', 'lanczos']
+TARGET_SIZE = (1280, 720)
+
+
+def capture():
+    import mss
+    with mss.mss() as sct:
+        shot = sct.grab(sct.monitors[1])
+        return Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', help='use this image instead of capturing the screen')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'format':>6} {'q':>4} {'resample':>9} {'capture ms':>11} {'resize ms':>10} {'encode ms':>10} "
+          f"{'b64 ms':>7} {'total ms':>9} {'bytes':>9} {'b64 bytes':>10}")
+
+    for (image_format, quality), resample in itertools.product(FORMATS, RESAMPLES):
+        encoder = ScreenshotEncoder(image_format=image_format, quality=quality or 80, size=TARGET_SIZE,
+                                    resample=resample)
+        timings = {'capture': [], 'resize': [], 'encode': [], 'b64': []}
+        for _ in range(args.runs):
+            if args.image:
+                img, capture_ms = timed(lambda: Image.open(args.image).convert('RGB'))
+            else:
+                img, capture_ms = timed(capture)
+            resized, resize_ms = timed(encoder.resize, img)
+            data, encode_ms = timed(encoder.encode, resized)
+            b64, b64_ms = timed(lambda: base64.b64encode(data).decode('utf-8'))
+            for stage, ms in zip(timings, (capture_ms, resize_ms, encode_ms, b64_ms)):
+                timings[stage].append(ms)
+
+        medians = {stage: statistics.median(values) for stage, values in timings.items()}
+        print(f"{image_format:>6} {quality or '-':>4} {resample:>9} {medians['capture']:>11.1f} "
+              f"{medians['resize']:>10.1f} {medians['encode']:>10.1f} {medians['b64']:>7.1f} "
+              f"{sum(medians.values()):>9.1f} {len(data):>9} {len(b64):>10}")
+
+
+if __name__ == '__main__':
+    main()
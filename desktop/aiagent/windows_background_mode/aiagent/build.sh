@@ -1,3 +1,4 @@
 #!/bin/bash
 
-nuitka --standalone --onefile --static-libpython=yes --output-dir=. --output-filename=agent main.py
\ No newline at end of file
+# screenshot_encoder.py lives in desktop/aiagent, shared with the desktop agent
+PYTHONPATH="$(cd "$(dirname "$0")/../.." && pwd)${PYTHONPATH:+:$PYTHONPATH}" nuitka --standalone --onefile --static-libpython=yes --output-dir=. --output-filename=agent main.py
\ No newline at end of file
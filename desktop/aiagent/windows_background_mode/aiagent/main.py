@@ -1,9 +1,7 @@
-import base64
 import time
 import requests
 import os
 import subprocess
-from io import BytesIO
 from PIL import Image
 import sys
 import io
@@ -11,6 +9,10 @@ import asyncio
 import logging
 import urllib
 
+# The screenshot encoder is shared with the desktop agent (desktop/aiagent), build.sh points nuitka at it too
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from screenshot_encoder import ScreenshotEncoder, screenshot_request  # noqa: E402
+
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 if hasattr(sys.stdout, "reconfigure"):
@@ -28,14 +30,14 @@ logging.basicConfig(
 
 screenshot_requested = False
 
-def take_screenshot_b64():
-    """Capture, resize, and return screenshot as base64 string without saving to disk."""
+screenshot_encoder = ScreenshotEncoder.from_env(image_format='jpeg', quality=60)
+
+
+def take_screenshot():
+    """Capture and return the encoded screenshot bytes without saving to disk."""
     proc = subprocess.Popen(["scrot", "-q", "60", "-"], stdout=subprocess.PIPE)
-    image = Image.open(proc.stdout).convert("RGB")
-    # image = image.resize((800, 500))
-    buffer = BytesIO()
-    image.save(buffer, format="JPEG", quality=60)
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    image = Image.open(proc.stdout)
+    return screenshot_encoder.encode(image)
 
 def safe_coords(x, y, screen_width, screen_height):
     return max(1, min(screen_width - 1, x)), max(1, min(screen_height - 1, y))
@@ -206,13 +208,16 @@ def get_next_step():
     payload = {
         'current_open_tabs': tabs,
         'current_url': current_url,
-        'screenshot_b64': take_screenshot_b64(),
+        'screenshot_media_type': screenshot_encoder.media_type,
     }
+    screenshot_data = take_screenshot()
 
     screenshot_requested = False
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        request_url, request_kwargs = screenshot_request(url, payload, headers, screenshot_data,
+                                                         screenshot_encoder.media_type)
+        response = requests.post(request_url, **request_kwargs)
         if response.status_code in (200, 201, 202):
             return response.json()
     except Exception as e:
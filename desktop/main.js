@@ -244,6 +244,7 @@ ipcMain.handle('get-suggestions', async (_, baseURL) => {
         NEURALAGENT_API_URL: baseURL,
         NEURALAGENT_USER_ACCESS_TOKEN: store.get(constants.ACCESS_TOKEN_STORE_KEY),
         NEURALAGENT_AGENT_MODE: 'suggestor',
+        NEURALAGENT_BINARY_SCREENSHOTS: process.env.NEURALAGENT_BINARY_SCREENSHOTS || 'false',
       },
     });
 
@@ -298,6 +299,10 @@ ipcMain.on('launch-ai-agent', async (_, baseURL, threadId, backgroundMode) => {
         NEURALAGENT_THREAD_ID: threadId,
         NEURALAGENT_USER_ACCESS_TOKEN: store.get(constants.ACCESS_TOKEN_STORE_KEY),
         NEURALAGENT_AGENT_MODE: 'agent',
+        NEURALAGENT_STREAM_NEXT_STEP: process.env.NEURALAGENT_STREAM_NEXT_STEP || 'false',
+        NEURALAGENT_UI_DELTA: process.env.NEURALAGENT_UI_DELTA || 'false',
+        NEURALAGENT_SCREENSHOT_DEDUPE: process.env.NEURALAGENT_SCREENSHOT_DEDUPE || 'false',
+        NEURALAGENT_BINARY_SCREENSHOTS: process.env.NEURALAGENT_BINARY_SCREENSHOTS || 'false',
         PYTHONUTF8: '1',
       },
     });
@@ -320,6 +325,7 @@ ipcMain.on('launch-ai-agent', async (_, baseURL, threadId, backgroundMode) => {
       NEURALAGENT_THREAD_ID: threadId,
       NEURALAGENT_USER_ACCESS_TOKEN: store.get(constants.ACCESS_TOKEN_STORE_KEY),
       SKIP_LLM_API_KEY_VERIFICATION: 'true',
+      NEURALAGENT_BINARY_SCREENSHOTS: process.env.NEURALAGENT_BINARY_SCREENSHOTS || 'false',
       PYTHONUTF8: '1',
     };
 
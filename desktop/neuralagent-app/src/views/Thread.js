@@ -113,12 +113,23 @@ export default function Thread() {
     });
   };
 
-  const getThreadMessages = () => {
+  const getThreadMessages = (onlyNew = false) => {
+    // When refreshing a thread that is already shown, only fetch the messages after the newest one we have
+    const since = onlyNew && messages.length > 0 ? Math.max(...messages.map((message) => message.id)) : null;
     dispatch(setLoadingDialog(true));
     axios.get(`/threads/${tid}/thread_messages`, {
+      params: since !== null ? { since } : {},
       headers: { 'Authorization': 'Bearer ' + accessToken }
     }).then(response => {
-      setMessages(response.data);
+      if (since === null) {
+        setMessages(response.data);
+      } else {
+        // A full fetch may have landed in the meantime (e.g. on agent exit), skip the messages it already added
+        setMessages((previous) => {
+          const knownIds = new Set(previous.map((message) => message.id));
+          return [...previous, ...response.data.filter((message) => !knownIds.has(message.id))];
+        });
+      }
       dispatch(setLoadingDialog(false));
     }).catch(error => {
       dispatch(setLoadingDialog(false));
@@ -163,7 +174,7 @@ export default function Thread() {
       }
       // TODO Remove
       getThread();
-      getThreadMessages();
+      getThreadMessages(true);
     }).catch((error) => {
       dispatch(setLoadingDialog(false));
       setSendingMessage(false);
@@ -219,7 +230,7 @@ export default function Thread() {
       dispatch(setLoadingDialog(false));
       window.electronAPI.stopAIAgent();
       // TODO Remove
-      getThreadMessages();
+      getThreadMessages(true);
       getThread();
     }).catch((error) => {
       dispatch(setLoadingDialog(false));